@@ -0,0 +1,1218 @@
+# log_index.py — индексы по логам, переживающие перезапуск приложения
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from log_search import (
+    CORRELATION_RE, ORDER_RE, PHONE_RE, SearchCancelled, entry_timestamp, is_gzip, iter_records,
+    iter_trace_entries, open_log, parse_record, trace_entry_ids, normalize_order
+)
+
+# Меняется при несовместимом изменении формата файла индекса
+INDEX_FORMAT = 6
+
+# Файл индекса: INDEX_MAGIC, таблицы, заголовок JSON, смещение заголовка (<Q) и снова INDEX_MAGIC
+INDEX_MAGIC = b"LAIDX\x00\x00\x01"
+FOOTER = struct.Struct("<Q8s")
+
+# Столько байтов перед концом проиндексированной части сверяется по контрольной сумме
+TAIL_CHECK_SIZE = 64 * 1024
+
+
+# Индексы, уже загруженные в этот процесс: (тип, путь) → индекс
+_loaded: Dict[Tuple[str, str], "LogIndex"] = {}
+_loaded_lock = threading.Lock()
+# Блокировки построения: второй поток ждёт уже идущее построение, а не начинает своё
+_building: Dict[Tuple[str, str], threading.Lock] = {}
+# Файлы, поставленные в очередь фонового построения, но ещё не проиндексированные
+_scheduled = set()
+
+# Как часто ожидающий построения индекса поток проверяет отмену, секунд
+BUILD_WAIT_INTERVAL = 0.1
+
+# Каждая такая по счёту запись попадает в индекс времени
+TIME_SAMPLE_STEP = 1024
+
+# Кусок лога под отдельный фильтр Блума, байтов
+BLOCK_SIZE = 4 * 1024 * 1024
+# Бит фильтра на ключ блока и число хешей: ложных срабатываний около 1%
+BLOOM_BITS_PER_KEY = 10
+BLOOM_HASHES = 7
+
+# Лимит места под индексы на диске по умолчанию, байтов
+DEFAULT_STORE_LIMIT = 2 * 1024 ** 3
+# Временный файл старше этого уже никто не пишет: prune его удаляет, секунд
+STALE_TEMP_AGE = 3600
+
+
+def index_dir() -> Path:
+    """Каталог для файлов индексов в пользовательском кэше"""
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "loyalty-analyzer"
+
+
+def file_key(path) -> Tuple[str, int]:
+    """Ключ кэша: путь и inode файла; ротация меняет inode"""
+    path = Path(path).resolve()
+    return str(path), path.stat().st_ino
+
+
+def tail_digest(path, end: int) -> str:
+    """sha1 последних TAIL_CHECK_SIZE байтов файла перед end"""
+    start = max(0, end - TAIL_CHECK_SIZE)
+    with open(path, "rb") as f:
+        f.seek(start)
+        return hashlib.sha1(f.read(end - start)).hexdigest()
+
+
+def _temp_path(target: Path) -> Tuple[int, Path]:
+    """(дескриптор, путь) нового временного файла рядом с target.
+
+    Имя у каждой записи своё: GUI и запущенный по расписанию index могут
+    писать один и тот же файл одновременно.
+    """
+    fd, name = tempfile.mkstemp(dir=target.parent, prefix=target.name + ".", suffix=".tmp")
+    return fd, Path(name)
+
+
+def _align(f, boundary: int = 8):
+    f.write(b"\x00" * (-f.tell() % boundary))
+
+
+# Код строки, не являющейся UUID: ESCAPE и номер строки в списке кодека
+ESCAPE = b"\xff" * 8
+UUID_RE = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+PHONE_KEY_RE = re.compile(r'[1-9][0-9]{0,18}')
+
+
+class UuidCodec:
+    """correlationId ↔ 16 байт: UUID как 128-битное число, прочие строки — номером в списке strings"""
+
+    width = 16
+
+    def __init__(self, strings=()):
+        self.strings = list(strings)
+        self._numbers = {text: number for number, text in enumerate(self.strings)}
+
+    def encode(self, text: str, add: bool = True) -> Optional[bytes]:
+        # UUID с восемью байтами 0xff в начале неотличим от ESCAPE: он тоже идёт в список
+        if UUID_RE.fullmatch(text) and not text.startswith("ffffffff-ffff-ffff"):
+            return bytes.fromhex(text.replace("-", ""))
+        number = self._numbers.get(text)
+        if number is None:
+            if not add:
+                return None
+            number = len(self.strings)
+            self.strings.append(text)
+            self._numbers[text] = number
+        return ESCAPE + number.to_bytes(8, "big")
+
+    def decode(self, code) -> str:
+        code = bytes(code)
+        if code[:8] == ESCAPE:
+            return self.strings[int.from_bytes(code[8:], "big")]
+        digits = code.hex()
+        return f"{digits[:8]}-{digits[8:12]}-{digits[12:16]}-{digits[16:20]}-{digits[20:]}"
+
+
+class PhoneCodec:
+    """Телефон 7XXXXXXXXXX ↔ 64-битное число (старшим байтом вперёд, чтобы байты сортировались как числа)"""
+
+    width = 8
+
+    def encode(self, text: str, add: bool = True) -> Optional[bytes]:
+        return int(text).to_bytes(8, "big") if PHONE_KEY_RE.fullmatch(text) else None
+
+    def decode(self, code) -> str:
+        return str(int.from_bytes(code, "big"))
+
+
+class TextCodec:
+    """Ключ как есть в UTF-8; ширина колонки на диске — по самому длинному ключу"""
+
+    width = 0
+
+    def encode(self, text: str, add: bool = True) -> Optional[bytes]:
+        return text.encode("utf-8")
+
+    def decode(self, code) -> str:
+        return bytes(code).rstrip(b"\x00").decode("utf-8")
+
+
+KEY_CODECS = {"phone": PhoneCodec, "uuid": UuidCodec, "text": TextCodec}
+
+
+class PostingTable:
+    """Ключ → постинги в порядке следования в файле.
+
+    Сохранённая часть лежит в файле индекса тремя массивами фиксированной
+    ширины: отсортированные коды ключей, начала списков и сами постинги.
+    Файл отображается в память, ключ ищется двоичным поиском на месте, без
+    чтения всей таблицы. Добавленное после загрузки хранится до следующего
+    сохранения столбцами: коды ключей, смещения и значения подряд в
+    bytearray/array, без объекта Python на каждую запись. В строки коды
+    превращаются только в ответах get.
+    """
+
+    def __init__(self, key: str, kind: str):
+        self.key = key  # кодек ключей из KEY_CODECS
+        self.kind = kind  # "cid": (смещение, correlationId), "ref": (смещение, длина)
+        self.key_codec = KEY_CODECS[key]()
+        self.value_codec = UuidCodec() if kind == "cid" else None
+        self.posting = struct.Struct("<Q16s" if kind == "cid" else "<QQ")
+        self._mm = None
+        self._section = None
+        self._clear_added()
+
+    def _clear_added(self):
+        # Коды ключей подряд; у текстовых ключей ширина растёт до самого длинного
+        self._keys = bytearray()
+        self._key_width = self.key_codec.width
+        self._offsets = array("Q")
+        self._values = bytearray() if self.kind == "cid" else array("Q")
+
+    def append(self, key: str, posting: tuple):
+        code = self.key_codec.encode(key)
+        if code is None:
+            raise ValueError(f"Ключ индекса не кодируется: {key!r}")
+        if len(code) > self._key_width:
+            self._widen(len(code))
+        self._keys += code.ljust(self._key_width, b"\x00")
+        offset, value = posting
+        self._offsets.append(offset)
+        if self.kind == "cid":
+            self._values += self.value_codec.encode(value)
+        else:
+            self._values.append(value)
+
+    def _widen(self, width: int):
+        old, old_width = self._keys, self._key_width
+        self._keys = bytearray(b"".join(old[row * old_width:(row + 1) * old_width].ljust(width, b"\x00")
+                                        for row in range(len(self._offsets))))
+        self._key_width = width
+
+    def attach(self, mm, section: dict):
+        """Подключает сохранённую часть таблицы из отображённого файла индекса"""
+        self._mm = mm
+        self._section = section
+        if self.key == "uuid":
+            self.key_codec = UuidCodec(section["key_strings"])
+        if self.kind == "cid":
+            self.value_codec = UuidCodec(section["value_strings"])
+        self._clear_added()
+
+    def detach(self):
+        self._mm = None
+        self._section = None
+
+    def reopened(self, mm, section: dict) -> "PostingTable":
+        """Новая таблица на сохранённом файле; эта остаётся как есть для тех, кто её ещё читает"""
+        table = PostingTable(self.key, self.kind)
+        table.attach(mm, section)
+        return table
+
+    def _saved_count(self) -> int:
+        return self._section["count"] if self._section is not None else 0
+
+    def _saved_key(self, number: int) -> bytes:
+        width, base = self._section["key_width"], self._section["keys"]
+        return self._mm[base + number * width:base + (number + 1) * width]
+
+    def _saved_span(self, number: int) -> Tuple[int, int]:
+        return struct.unpack_from("<QQ", self._mm, self._section["starts"] + number * 8)
+
+    def _find(self, key: str) -> int:
+        """Номер ключа в сохранённой части или -1"""
+        count = self._saved_count()
+        code = self.key_codec.encode(key, add=False)
+        if not count or code is None or len(code) > self._section["key_width"]:
+            return -1
+        code = code.ljust(self._section["key_width"], b"\x00")
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if self._saved_key(middle) < code:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < count and self._saved_key(low) == code else -1
+
+    def _decode(self, offset: int, value) -> tuple:
+        return (offset, self.value_codec.decode(value)) if self.kind == "cid" else (offset, value)
+
+    def _saved(self, number: int) -> List[tuple]:
+        start, stop = self._saved_span(number)
+        base, size = self._section["postings"], self.posting.size
+        return [self._decode(*self.posting.unpack_from(self._mm, base + i * size)) for i in range(start, stop)]
+
+    def _added_key(self, row: int) -> bytes:
+        width = self._key_width
+        return bytes(self._keys[row * width:(row + 1) * width])
+
+    def _added_value(self, row: int):
+        return bytes(self._values[row * 16:(row + 1) * 16]) if self.kind == "cid" else self._values[row]
+
+    def _added_rows(self, code: bytes) -> List[int]:
+        width = self._key_width
+        if len(code) > width:
+            return []
+        code = code.ljust(width, b"\x00")
+        rows = []
+        position = self._keys.find(code)
+        while position >= 0:
+            if position % width == 0:
+                rows.append(position // width)
+                position = self._keys.find(code, position + width)
+            else:
+                position = self._keys.find(code, position + 1)
+        return rows
+
+    def get(self, key: str, default=None) -> List[tuple]:
+        number = self._find(key)
+        postings = self._saved(number) if number >= 0 else []
+        if self._offsets:
+            # Добавленное живёт только до конца update: его просматриваем подряд
+            code = self.key_codec.encode(key, add=False)
+            if code is not None:
+                postings += [self._decode(self._offsets[row], self._added_value(row)) for row in self._added_rows(code)]
+        if not postings:
+            return [] if default is None else default
+        return postings
+
+    def items(self) -> Dict[str, List[tuple]]:
+        """Вся таблица строками, сохранённое вместе с добавленным; читает файл индекса целиком"""
+        merged = {}
+        for number in range(self._saved_count()):
+            merged[self.key_codec.decode(self._saved_key(number))] = self._saved(number)
+        for row in range(len(self._offsets)):
+            merged.setdefault(self.key_codec.decode(self._added_key(row)), []).append(
+                self._decode(self._offsets[row], self._added_value(row)))
+        return merged
+
+    def _merged(self, added_order: List[int], width: int):
+        """(код ключа шириной width, номер в сохранённой части или -1, диапазон added_order) по возрастанию ключа"""
+        saved_count = self._saved_count()
+        number = position = 0
+        while number < saved_count or position < len(added_order):
+            saved = bytes(self._saved_key(number)).ljust(width, b"\x00") if number < saved_count else None
+            added = self._added_key(added_order[position]).ljust(width, b"\x00") \
+                if position < len(added_order) else None
+            code = min(key for key in (saved, added) if key is not None)
+            stop = position
+            while stop < len(added_order) and self._added_key(added_order[stop]).ljust(width, b"\x00") == code:
+                stop += 1
+            yield code, (number if saved == code else -1), position, stop
+            if saved == code:
+                number += 1
+            position = stop
+
+    def write(self, f) -> dict:
+        """Пишет таблицу целиком (сохранённое и добавленное) с текущей позиции f; возвращает её описание"""
+        # Сортировка устойчива: постинги одного ключа остаются в порядке файла
+        added_order = sorted(range(len(self._offsets)), key=self._added_key)
+        width = max(self._section["key_width"] if self._section else 0, self._key_width)
+
+        section = {"key_width": width}
+        _align(f)
+        section["keys"] = f.tell()
+        starts = array("Q", [0])
+        for code, number, start, stop in self._merged(added_order, width):
+            f.write(code)
+            saved = self._saved_span(number) if number >= 0 else (0, 0)
+            starts.append(starts[-1] + saved[1] - saved[0] + stop - start)
+        section["count"] = len(starts) - 1
+        _align(f)
+        section["starts"] = f.tell()
+        if sys.byteorder != "little":
+            starts.byteswap()
+        f.write(starts.tobytes())
+        _align(f)
+        section["postings"] = f.tell()
+        size = self.posting.size
+        for _, number, start, stop in self._merged(added_order, width):
+            if number >= 0:
+                first, last = self._saved_span(number)
+                base = self._section["postings"]
+                f.write(self._mm[base + first * size:base + last * size])
+            for row in added_order[start:stop]:
+                f.write(self.posting.pack(self._offsets[row], self._added_value(row)))
+        if self.key == "uuid":
+            section["key_strings"] = self.key_codec.strings
+        if self.kind == "cid":
+            section["value_strings"] = self.value_codec.strings
+        return section
+
+
+class TimeTable:
+    """Редкий индекс времени: отметка и смещение каждой TIME_SAMPLE_STEP-й записи лога.
+
+    Отметки (ГГГГ-ММ-ДД ЧЧ:ММ:СС) идут в порядке файла и почти не убывают,
+    поэтому период находится двоичным поиском по ним без чтения лога.
+    """
+
+    WIDTH = 19
+
+    def __init__(self):
+        self._mm = None
+        self._section = None
+        self._clear_added()
+
+    def _clear_added(self):
+        self._stamps = bytearray()
+        self._offsets = array("Q")
+
+    def append(self, stamp: str, offset: int):
+        self._stamps += stamp.encode("ascii")
+        self._offsets.append(offset)
+
+    def attach(self, mm, section: dict):
+        self._mm = mm
+        self._section = section
+        self._clear_added()
+
+    def detach(self):
+        self._mm = None
+        self._section = None
+
+    def reopened(self, mm, section: dict) -> "TimeTable":
+        table = TimeTable()
+        table.attach(mm, section)
+        return table
+
+    def _saved_count(self) -> int:
+        return self._section["count"] if self._section is not None else 0
+
+    def __len__(self) -> int:
+        return self._saved_count() + len(self._offsets)
+
+    def stamp(self, number: int) -> bytes:
+        saved = self._saved_count()
+        if number < saved:
+            base = self._section["stamps"] + number * self.WIDTH
+            return self._mm[base:base + self.WIDTH]
+        number -= saved
+        return bytes(self._stamps[number * self.WIDTH:(number + 1) * self.WIDTH])
+
+    def offset(self, number: int) -> int:
+        saved = self._saved_count()
+        if number < saved:
+            return struct.unpack_from("<Q", self._mm, self._section["offsets"] + number * 8)[0]
+        return self._offsets[number - saved]
+
+    def items(self) -> List[Tuple[str, int]]:
+        """Все отметки с их смещениями"""
+        return [(self.stamp(number).decode("ascii"), self.offset(number)) for number in range(len(self))]
+
+    def _bisect(self, stamp: bytes) -> int:
+        """Число отметок меньше stamp"""
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self.stamp(middle) < stamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def window(self, since: Optional[str] = None, until: Optional[str] = None) -> Tuple[int, Optional[int]]:
+        """Диапазон [начало, конец) файла, где могут лежать записи периода; конец None — до конца файла"""
+        start, end = 0, None
+        if since is not None:
+            # Записи до первой отметки не раньше since могут быть в периоде: берём и предыдущий отрезок
+            number = self._bisect(since.encode("ascii"))
+            if number > 0:
+                start = self.offset(number - 1)
+        if until is not None:
+            # Первая отметка позже until: дальше записей периода уже нет
+            number = self._bisect(until.encode("ascii") + b"\x00")
+            if number < len(self):
+                end = self.offset(number)
+        return start, end
+
+    def write(self, f) -> dict:
+        section = {"count": len(self)}
+        _align(f)
+        section["stamps"] = f.tell()
+        if self._section is not None:
+            base = self._section["stamps"]
+            f.write(self._mm[base:base + self._saved_count() * self.WIDTH])
+        f.write(self._stamps)
+        _align(f)
+        section["offsets"] = f.tell()
+        if self._section is not None:
+            base = self._section["offsets"]
+            f.write(self._mm[base:base + self._saved_count() * 8])
+        offsets = array("Q", self._offsets)
+        if sys.byteorder != "little":
+            offsets.byteswap()
+        f.write(offsets.tobytes())
+        return section
+
+
+def _bloom_hashes(key: str) -> Tuple[int, int]:
+    """Два хеша ключа, не зависящие от запуска; остальные BLOOM_HASHES получаются их комбинацией"""
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+class BloomTable:
+    """Фильтры Блума по блокам лога: начало каждого блока и биты его ключей.
+
+    На фильтр блока отводится BLOOM_BITS_PER_KEY бит на его ключ, поэтому
+    таблица в десятки раз меньше индекса. Ключа, которого в блоке нет,
+    фильтр почти всегда не допускает; ключ из блока допускает всегда.
+    """
+
+    def __init__(self):
+        self._mm = None
+        self._section = None
+        self._saved = 0  # блоков из файла индекса; pop может убрать последние
+        self._clear_added()
+
+    def _clear_added(self):
+        self._starts = array("Q")
+        self._bounds = array("Q", [0])  # границы фильтров добавленных блоков в _blooms
+        self._blooms = bytearray()
+
+    def attach(self, mm, section: dict):
+        self._mm = mm
+        self._section = section
+        self._saved = section["count"]
+        self._clear_added()
+
+    def detach(self):
+        self._mm = None
+        self._section = None
+        self._saved = 0
+
+    def reopened(self, mm, section: dict) -> "BloomTable":
+        table = BloomTable()
+        table.attach(mm, section)
+        return table
+
+    def __len__(self) -> int:
+        return self._saved + len(self._starts)
+
+    def append(self, start: int, keys):
+        """Блок, начинающийся со смещения start, с фильтром по ключам keys"""
+        bits = max(64, -(-len(keys) * BLOOM_BITS_PER_KEY // 64) * 64)
+        bloom = bytearray(bits // 8)
+        for key in keys:
+            first, step = _bloom_hashes(key)
+            for number in range(BLOOM_HASHES):
+                bit = (first + number * step) % bits
+                bloom[bit >> 3] |= 1 << (bit & 7)
+        self._starts.append(start)
+        self._blooms += bloom
+        self._bounds.append(len(self._blooms))
+
+    def pop(self) -> int:
+        """Убирает последний блок и возвращает его начало"""
+        start = self.start(len(self) - 1)
+        if self._starts:
+            self._starts.pop()
+            self._bounds.pop()
+            del self._blooms[self._bounds[-1]:]
+        else:
+            self._saved -= 1
+        return start
+
+    def _saved_u64(self, name: str, number: int) -> int:
+        return struct.unpack_from("<Q", self._mm, self._section[name] + number * 8)[0]
+
+    def start(self, number: int) -> int:
+        if number < self._saved:
+            return self._saved_u64("starts", number)
+        return self._starts[number - self._saved]
+
+    def _bloom(self, number: int):
+        """(буфер, начало, конец) фильтра блока"""
+        if number < self._saved:
+            base = self._section["blooms"]
+            return self._mm, base + self._saved_u64("bounds", number), base + self._saved_u64("bounds", number + 1)
+        number -= self._saved
+        return self._blooms, self._bounds[number], self._bounds[number + 1]
+
+    def candidates(self, key: str) -> List[int]:
+        """Номера блоков, в которых key может встретиться"""
+        first, step = _bloom_hashes(key)
+        found = []
+        for block in range(len(self)):
+            data, begin, end = self._bloom(block)
+            bits = (end - begin) * 8
+            for number in range(BLOOM_HASHES):
+                bit = (first + number * step) % bits
+                if not data[begin + (bit >> 3)] & (1 << (bit & 7)):
+                    break
+            else:
+                found.append(block)
+        return found
+
+    def write(self, f) -> dict:
+        section = {"count": len(self)}
+        saved_bytes = self._saved_u64("bounds", self._saved) if self._section is not None else 0
+        added_bounds = array("Q", (bound + saved_bytes for bound in self._bounds[1:]))
+        starts = array("Q", self._starts)
+        if sys.byteorder != "little":
+            added_bounds.byteswap()
+            starts.byteswap()
+        _align(f)
+        section["starts"] = f.tell()
+        if self._section is not None:
+            base = self._section["starts"]
+            f.write(self._mm[base:base + self._saved * 8])
+        f.write(starts.tobytes())
+        _align(f)
+        section["bounds"] = f.tell()
+        if self._section is not None:
+            base = self._section["bounds"]
+            f.write(self._mm[base:base + (self._saved + 1) * 8])
+        else:
+            f.write(struct.pack("<Q", 0))
+        f.write(added_bounds.tobytes())
+        _align(f)
+        section["blooms"] = f.tell()
+        if self._section is not None:
+            base = self._section["blooms"]
+            f.write(self._mm[base:base + saved_bytes])
+        f.write(self._blooms)
+        return section
+
+
+class IndexStore:
+    """Учёт файлов индексов в пользовательском кэше между запусками приложения.
+
+    В store.json хранятся лог и время последнего использования каждого
+    индекса, лимит места на диске и последние выбранные логи. prune удаляет
+    индексы исчезнувших логов и самые давно не использованные, пока все
+    индексы не уложатся в лимит.
+    """
+
+    MANIFEST = "store.json"
+
+    def __init__(self, root: Optional[Path] = None):
+        self._root = Path(root) if root is not None else None
+        self._lock = threading.Lock()
+
+    @property
+    def root(self) -> Path:
+        return self._root if self._root is not None else index_dir()
+
+    def _read(self) -> dict:
+        try:
+            with open(self.root / self.MANIFEST, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        manifest.setdefault("limit", DEFAULT_STORE_LIMIT)
+        manifest.setdefault("last_logs", {})
+        manifest.setdefault("entries", {})
+        return manifest
+
+    def _write(self, manifest: dict):
+        self.root.mkdir(parents=True, exist_ok=True)
+        fd, tmp = _temp_path(self.root / self.MANIFEST)
+        try:
+            with open(fd, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, self.root / self.MANIFEST)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    @property
+    def limit(self) -> int:
+        return self._read()["limit"]
+
+    def set_limit(self, limit: int):
+        """Новый лимит места под индексы; лишние индексы сразу вытесняются"""
+        with self._lock:
+            manifest = self._read()
+            manifest["limit"] = max(0, int(limit))
+            self._write(manifest)
+        self.prune()
+
+    def touch(self, index_file: Path, log_path):
+        """Отмечает использование индекса лога"""
+        with self._lock:
+            manifest = self._read()
+            manifest["entries"][Path(index_file).name] = {"log": str(log_path), "used": time.time()}
+            self._write(manifest)
+
+    def remember_logs(self, full_log_path, trace_log_path):
+        with self._lock:
+            manifest = self._read()
+            manifest["last_logs"] = {"full": str(full_log_path) if full_log_path else None,
+                                     "trace": str(trace_log_path) if trace_log_path else None}
+            self._write(manifest)
+
+    def last_logs(self) -> Tuple[Optional[str], Optional[str]]:
+        """Последние выбранные full.log и loyaltyTrace.log, если они ещё существуют"""
+        last = self._read()["last_logs"]
+        return tuple(path if path and os.path.exists(path) else None
+                     for path in (last.get("full"), last.get("trace")))
+
+    def prune(self, keep: Optional[Path] = None) -> int:
+        """Удаляет индексы исчезнувших логов, брошенные временные файлы и вытесняет старые индексы сверх лимита.
+
+        Возвращает число удалённых файлов.
+        """
+        removed = 0
+        with self._lock:
+            manifest = self._read()
+            entries = manifest["entries"]
+            files = []
+            now = time.time()
+            for temp_file in self.root.glob("*.tmp"):
+                # Брошенные временные файлы (упавшая запись, незаменённый индекс) тоже занимают место
+                try:
+                    st = temp_file.stat()
+                except OSError:
+                    continue
+                if now - st.st_mtime > STALE_TEMP_AGE and _remove(temp_file):
+                    removed += 1
+                    continue
+                files.append((float("inf"), temp_file, st.st_size))
+            for index_file in self.root.glob("*.idx"):
+                try:
+                    st = index_file.stat()
+                except OSError:
+                    continue
+                entry = entries.get(index_file.name)
+                if entry is not None and not os.path.exists(entry["log"]):
+                    if _remove(index_file):
+                        removed += 1
+                    continue
+                # Индексы без записи в store.json (прежних версий) считаются использованными при записи
+                files.append((entry["used"] if entry else st.st_mtime, index_file, st.st_size))
+
+            total = sum(size for _, _, size in files)
+            for _, index_file, size in sorted(files, key=lambda item: item[0]):
+                if total <= manifest["limit"]:
+                    break
+                if (keep is not None and index_file == keep) or index_file.suffix == ".tmp":
+                    continue
+                if _remove(index_file):
+                    total -= size
+                    removed += 1
+
+            present = {index_file.name for index_file in self.root.glob("*.idx")}
+            manifest["entries"] = {name: entry for name, entry in entries.items() if name in present}
+            self._write(manifest)
+        if removed:
+            print(f"[DEBUG] Удалено индексов из кэша: {removed}", file=sys.stderr)
+        return removed
+
+
+def _remove(index_file: Path) -> bool:
+    try:
+        index_file.unlink(missing_ok=True)
+    except OSError as e:
+        # Windows не удаляет файл, пока он отображён в память другим индексом
+        print(f"[DEBUG] Индекс не удалён: {index_file}: {e}", file=sys.stderr)
+        return False
+    return True
+
+
+# Общий учёт индексов процесса
+store = IndexStore()
+
+
+def _map_index(index_file: Path):
+    try:
+        with open(index_file, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+
+def _read_header(mm) -> Optional[dict]:
+    """Заголовок файла индекса или None, если файл не того формата или обрезан"""
+    if len(mm) < len(INDEX_MAGIC) + FOOTER.size or mm[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+        return None
+    position, magic = FOOTER.unpack_from(mm, len(mm) - FOOTER.size)
+    if magic != INDEX_MAGIC or position > len(mm) - FOOTER.size:
+        return None
+    try:
+        return json.loads(mm[position:len(mm) - FOOTER.size])
+    except ValueError:
+        return None
+
+
+class LogIndex:
+    """Общая часть индексов: ключ файла, дописывание и хранение на диске.
+
+    Индекс покрывает первые size байтов файла. Последняя запись может ещё
+    дописываться, поэтому в индекс не попадает: поиск досматривает хвост
+    после size сам. Если файл только дописывался (размер не меньше size и
+    контрольная сумма конца проиндексированной части сошлась), open
+    разбирает лишь новые байты; обрезанный или заменённый файл индексируется заново.
+    """
+
+    # Расширение файла индекса и сохраняемые атрибуты задают наследники
+    suffix = ""
+    fields: Tuple[str, ...] = ()
+    # Атрибуты, сохраняемые в заголовке файла индекса
+    state: Tuple[str, ...] = ("size", "digest", "compressed", "records", "sampled_at")
+
+    def __init__(self, key):
+        self.key = key
+        self.size = 0  # проиндексированное начало файла, байтов на диске
+        self.digest = ""  # tail_digest проиндексированной части
+        self.compressed = False  # .gz индексируется только целиком
+        self._verified = None  # (размер, mtime) файла, для которых digest уже сверен
+        self._mm = None  # отображённый в память файл индекса с сохранёнными таблицами
+        self._unplaced = None  # временный файл, который читают таблицы, если заменить им индекс не удалось
+        self._swap_lock = threading.Lock()  # save подменяет таблицы разом
+        self.records = 0  # записей в проиндексированной части
+        self.sampled_at = -TIME_SAMPLE_STEP  # номер записи, попавшей в индекс времени последней
+        self.times = TimeTable()
+
+    @classmethod
+    def index_path(cls, path) -> Path:
+        digest = hashlib.sha1(str(Path(path).resolve()).encode("utf-8")).hexdigest()
+        return index_dir() / f"{digest}.{cls.suffix}.idx"
+
+    @classmethod
+    def new(cls, path) -> "LogIndex":
+        """Пустой индекс файла: update разберёт его с начала"""
+        index = cls(file_key(path))
+        index.compressed = is_gzip(path)
+        return index
+
+    @classmethod
+    def build(cls, path, cancel=None, progress=None) -> "LogIndex":
+        index = cls.new(path)
+        index.update(path, cancel, progress)
+        return index
+
+    @classmethod
+    def load(cls, path) -> Optional["LogIndex"]:
+        """Индекс с диска, если файл с тех пор только дописывался.
+
+        Файл индекса отображается в память и читается только заголовок:
+        таблицы ищутся на месте, поэтому открытие не зависит от размера лога.
+        """
+        mm = _map_index(cls.index_path(path))
+        if mm is None:
+            return None
+        header = _read_header(mm)
+        if header is None or header.get("format") != INDEX_FORMAT:
+            mm.close()
+            return None
+        index = cls(tuple(header["key"]))
+        for name in cls.state:
+            setattr(index, name, header[name])
+        index._attach(mm, header)
+        if not index.matches(path):
+            index._detach()
+            return None
+        return index
+
+    def _attach(self, mm, header: dict):
+        self._mm = mm
+        for name in self.fields:
+            getattr(self, name).attach(mm, header["tables"][name])
+
+    def _detach(self):
+        for name in self.fields:
+            getattr(self, name).detach()
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    @classmethod
+    def cached(cls, path) -> Optional["LogIndex"]:
+        """Готовый индекс из памяти процесса или с диска, без построения.
+
+        Индекс может отставать от файла: записи после size не проиндексированы.
+        """
+        slot = (cls.suffix, str(Path(path).resolve()))
+        with _loaded_lock:
+            index = _loaded.get(slot)
+        if index is not None and index.matches(path):
+            return index
+
+        index = cls.load(path)
+        if index is not None:
+            with _loaded_lock:
+                _loaded[slot] = index
+            store.touch(cls.index_path(path), Path(path).resolve())
+        return index
+
+    @classmethod
+    def _build_lock(cls, path) -> threading.Lock:
+        slot = (cls.suffix, str(Path(path).resolve()))
+        with _loaded_lock:
+            return _building.setdefault(slot, threading.Lock())
+
+    @classmethod
+    def schedule(cls, path, scheduled: bool = True):
+        """Отмечает файл, индекс которого скоро начнёт строиться в фоне (или снимает отметку)"""
+        slot = (cls.suffix, str(Path(path).resolve()))
+        with _loaded_lock:
+            if scheduled:
+                _scheduled.add(slot)
+            else:
+                _scheduled.discard(slot)
+
+    @classmethod
+    def building(cls, path) -> bool:
+        """Индекс файла строится другим потоком или стоит в очереди на построение"""
+        slot = (cls.suffix, str(Path(path).resolve()))
+        with _loaded_lock:
+            if slot in _scheduled:
+                return True
+        return cls._build_lock(path).locked()
+
+    @classmethod
+    def open(cls, path, cancel=None, progress=None) -> "LogIndex":
+        """Индекс из памяти процесса или с диска, дописанный до конца файла, либо построенный заново.
+
+        Если индекс уже строится в другом потоке, дожидается его и только
+        дописывает остаток. Прерванное отменой построение несжатого файла
+        сохраняется: следующий open продолжит с того же места.
+        """
+        lock = cls._build_lock(path)
+        while not lock.acquire(timeout=BUILD_WAIT_INTERVAL):
+            if cancel is not None and cancel.is_set():
+                raise SearchCancelled()
+        try:
+            index = cls.cached(path)
+            fresh = index is None
+            if fresh:
+                index = cls.new(path)
+            try:
+                changed = index.update(path, cancel, progress)
+            except SearchCancelled:
+                if index.compressed or not index.size:
+                    raise
+                index.store(path)
+                raise
+            if changed or fresh:
+                index.store(path)
+            cls.schedule(path, False)
+            return index
+        finally:
+            lock.release()
+
+    def store(self, path):
+        """Сохраняет индекс на диск и в память процесса"""
+        self.save()
+        with _loaded_lock:
+            _loaded[(self.suffix, str(Path(path).resolve()))] = self
+
+    def save(self):
+        """Пишет индекс в новый файл и переключается на него; добавленное в памяти уходит на диск.
+
+        Поиск в другом потоке или открытая история могут ещё читать прежние
+        таблицы, поэтому их отображение не закрывается: новые таблицы на новом
+        файле подменяют их целиком, а старое отображение закроется вместе с
+        последней ссылкой на старые таблицы.
+        """
+        target = self.index_path(self.key[0])
+        target.parent.mkdir(parents=True, exist_ok=True)
+        header = {"format": INDEX_FORMAT, "key": list(self.key), "tables": {}}
+        header.update((name, getattr(self, name)) for name in self.state)
+        fd, tmp = _temp_path(target)
+        try:
+            with open(fd, "wb") as f:
+                f.write(INDEX_MAGIC)
+                for name in self.fields:
+                    header["tables"][name] = getattr(self, name).write(f)
+                position = f.tell()
+                f.write(json.dumps(header).encode("utf-8"))
+                f.write(FOOTER.pack(position, INDEX_MAGIC))
+            mm = _map_index(tmp)
+            if mm is None:
+                raise OSError(f"Не удалось открыть сохранённый индекс: {tmp}")
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        tables = {name: getattr(self, name).reopened(mm, header["tables"][name]) for name in self.fields}
+        with self._swap_lock:
+            for name, table in tables.items():
+                setattr(self, name, table)
+            self._mm = mm
+        unplaced, self._unplaced = self._unplaced, None
+        try:
+            os.replace(tmp, target)
+        except OSError as e:
+            # Windows не даёт заменить файл, пока старые таблицы у читателей держат его отображение:
+            # новые таблицы читают временный файл, замена повторится при следующем сохранении
+            print(f"[DEBUG] Индекс не заменён на диске: {target}: {e}", file=sys.stderr)
+            self._unplaced = tmp
+        if unplaced is not None:
+            # Прежний временный файл больше не нужен; если его ещё читают, удалит prune
+            _remove(unplaced)
+        if self._unplaced is not None:
+            return
+        store.touch(target, self.key[0])
+        store.prune(keep=target)
+
+    def matches(self, path) -> bool:
+        """Файл тот же, что индексировался, и с тех пор только дописывался"""
+        try:
+            st = os.stat(path)
+            if self.key != file_key(path) or st.st_size < self.size:
+                return False
+            if self.compressed and st.st_size != self.size:
+                return False
+            if self._verified == (st.st_size, st.st_mtime_ns):
+                return True
+            if tail_digest(path, self.size) != self.digest:
+                return False
+        except OSError:
+            return False
+        self._verified = (st.st_size, st.st_mtime_ns)
+        return True
+
+    def unindexed(self, path) -> int:
+        """Сколько байтов в конце файла ещё не попало в индекс"""
+        return max(0, os.path.getsize(path) - self.size)
+
+    def update(self, path, cancel=None, progress=None) -> bool:
+        """Разбирает байты после size и добавляет их записи; False, если добавлять нечего"""
+        if self.compressed and self.size:
+            # Архив не дописывается: он уже проиндексирован целиком
+            return False
+        indexed = self.size
+        pending = None
+        try:
+            with open_log(path, progress) as (f, progress):
+                f.seek(self.size)
+                for offset, data in self.iter_entries(f, cancel, progress):
+                    if pending is not None:
+                        self._add(*pending)
+                        if not self.compressed:
+                            # size растёт вместе с записями: прерванное обновление не задвоит их
+                            self.size = offset
+                    pending = (offset, data)
+            if self.compressed:
+                if pending is not None:
+                    self._add(*pending)
+                self.size = os.path.getsize(path)
+            # Последняя запись несжатого лога может дописываться: её разберёт следующее обновление
+        finally:
+            if self.size != indexed:
+                self.digest = tail_digest(path, self.size)
+                self._verified = None
+        return self.size != indexed
+
+    def _add(self, offset: int, data: bytes):
+        if self.records - self.sampled_at >= TIME_SAMPLE_STEP:
+            # Запись без отметки времени не годится в образцы: тогда берётся следующая
+            stamp = entry_timestamp(data)
+            if stamp is not None:
+                self.times.append(stamp, offset)
+                self.sampled_at = self.records
+        self.records += 1
+        self.add_entry(offset, data)
+
+    def window(self, since: Optional[str] = None, until: Optional[str] = None) -> Tuple[int, Optional[int]]:
+        """Часть проиндексированного файла, где могут быть записи периода (см. TimeTable.window)"""
+        return self.times.window(since, until)
+
+    def iter_entries(self, f, cancel=None, progress=None):
+        """(смещение, байты) записей лога с текущей позиции f"""
+        raise NotImplementedError
+
+    def add_entry(self, offset: int, data: bytes):
+        raise NotImplementedError
+
+
+class FullLogIndex(LogIndex):
+    """Телефон/заказ → correlationId со смещениями записей в full.log и обратно"""
+
+    suffix = "full"
+    fields = ("phones", "orders", "correlations", "times")
+
+    def __init__(self, key):
+        super().__init__(key)
+        # ключ → [(смещение записи, correlationId)] в порядке следования в файле
+        self.phones = PostingTable("phone", "cid")
+        self.orders = PostingTable("text", "cid")
+        # correlationId в нижнем регистре → [(смещение, длина)] записей с ним
+        self.correlations = PostingTable("uuid", "ref")
+
+    def iter_entries(self, f, cancel=None, progress=None):
+        return iter_records(f, cancel=cancel, progress=progress)
+
+    def add_entry(self, offset: int, data: bytes):
+        self.add_record(parse_record(offset, data))
+
+    def add_record(self, record):
+        if not record.correlation_id:
+            return
+        # В нижнем регистре UUID кодируется 16 байтами; иначе он ушёл бы в список строк заголовка
+        correlation_id = record.correlation_id.lower()
+        entry = (record.offset, correlation_id)
+        self.correlations.append(correlation_id, (record.offset, record.length))
+        for phone in record.phones:
+            self.phones.append(phone, entry)
+        for order in record.orders:
+            self.orders.append(order, entry)
+
+    def phone_entries(self, phone: str) -> List[Tuple[int, str]]:
+        return self.phones.get(phone, [])
+
+    def order_entries(self, order_number: str) -> List[Tuple[int, str]]:
+        return self.orders.get(normalize_order(order_number), [])
+
+    def correlation_refs(self, correlation_id: str) -> List[Tuple[int, int]]:
+        return self.correlations.get(correlation_id.lower(), [])
+
+    def latest_phone(self, phone: str) -> Optional[Tuple[int, str]]:
+        entries = self.phone_entries(phone)
+        return entries[-1] if entries else None
+
+    def latest_order(self, order_number: str) -> Optional[Tuple[int, str]]:
+        entries = self.order_entries(order_number)
+        return entries[-1] if entries else None
+
+
+class TraceIndex(LogIndex):
+    """correlationId → ссылки (смещение, длина) на записи loyaltyTrace.log"""
+
+    suffix = "trace"
+    fields = ("entries", "times")
+
+    def __init__(self, key):
+        super().__init__(key)
+        # correlationId в нижнем регистре → [(смещение, длина)]
+        self.entries = PostingTable("uuid", "ref")
+
+    def iter_entries(self, f, cancel=None, progress=None):
+        return iter_trace_entries(f, cancel=cancel, progress=progress)
+
+    def add_entry(self, offset: int, data: bytes):
+        ref = (offset, len(data))
+        for correlation_id in trace_entry_ids(data):
+            self.entries.append(correlation_id, ref)
+
+    def entry_refs(self, correlation_id: str) -> List[Tuple[int, int]]:
+        return self.entries.get(correlation_id.lower(), [])
+
+    def latest(self, correlation_id: str) -> Optional[Tuple[int, int]]:
+        refs = self.entry_refs(correlation_id)
+        return refs[-1] if refs else None
+
+
+class BlockFilter(LogIndex):
+    """Фильтры Блума по блокам лога около BLOCK_SIZE байтов: где ключа точно нет.
+
+    Строятся одним быстрым проходом раньше полного индекса: ключи ищутся
+    регулярными выражениями сразу во всём блоке, а на диск идут только
+    биты фильтров. Блоки начинаются с начала записи; пока полного индекса
+    нет, поиск сканирует лишь блоки, фильтр которых допускает ключ.
+    """
+
+    fields = ("blocks",)
+    state = LogIndex.state + ("seen",)
+
+    def __init__(self, key):
+        super().__init__(key)
+        self.blocks = BloomTable()
+        self.seen = 0  # размер файла при последнем обновлении
+
+    def update(self, path, cancel=None, progress=None) -> bool:
+        """Добавляет блоки после size; недобранный последний блок собирается заново вместе с дописанным"""
+        if self.compressed and self.size:
+            return False
+        if os.path.getsize(path) == self.seen:
+            return False
+        indexed, seen = self.size, self.seen
+        last = len(self.blocks) - 1
+        if last >= 0 and not self.compressed and self.size - self.blocks.start(last) < BLOCK_SIZE:
+            self.size = self.blocks.pop()
+        start = self.size
+        try:
+            with open_log(path, progress) as (f, progress):
+                f.seek(start)
+                block_start, parts, pending = start, [], None
+                for offset, data in self.iter_entries(f, cancel, progress):
+                    if pending is not None:
+                        if pending[0] - block_start >= BLOCK_SIZE and parts:
+                            self.blocks.append(block_start, self.block_keys(b"".join(parts)))
+                            block_start, parts = pending[0], []
+                            if not self.compressed:
+                                self.size = block_start
+                        parts.append(pending[1])
+                    pending = (offset, data)
+            if self.compressed and pending is not None:
+                parts.append(pending[1])
+            # Как и в индексе, последняя запись несжатого лога может дописываться: она остаётся за size
+            if parts:
+                self.blocks.append(block_start, self.block_keys(b"".join(parts)))
+            self.size = os.path.getsize(path) if self.compressed else (pending[0] if pending else start)
+            self.seen = os.path.getsize(path)
+        finally:
+            if self.size != indexed:
+                self.digest = tail_digest(path, self.size)
+                self._verified = None
+        return self.size != indexed or self.seen != seen
+
+    def block_keys(self, data: bytes) -> Set[str]:
+        """Ключи блока для фильтра"""
+        raise NotImplementedError
+
+    def candidate_blocks(self, key: str) -> List[Tuple[int, Optional[int]]]:
+        """[начало, конец) блоков, где key может встретиться; конец None — до конца файла"""
+        blocks = []
+        for number in self.blocks.candidates(key):
+            if number + 1 < len(self.blocks):
+                end = self.blocks.start(number + 1)
+            else:
+                end = None if self.compressed else self.size
+            blocks.append((self.blocks.start(number), end))
+        return blocks
+
+
+class FullLogFilter(BlockFilter):
+    """Фильтры блоков full.log по телефонам, заказам и correlationId"""
+
+    suffix = "full-blocks"
+
+    def iter_entries(self, f, cancel=None, progress=None):
+        return iter_records(f, cancel=cancel, progress=progress)
+
+    def block_keys(self, data: bytes) -> Set[str]:
+        # Ключи разных видов не пересекаются благодаря приставкам
+        keys = {"p" + "7" + m[1:].decode("ascii") for m in set(PHONE_RE.findall(data))}
+        keys.update("o" + normalize_order(m.decode("ascii")) for m in set(ORDER_RE.findall(data)))
+        keys.update("c" + m.decode("ascii").lower() for m in set(CORRELATION_RE.findall(data)))
+        return keys
+
+    def phone_blocks(self, phone: str) -> List[Tuple[int, Optional[int]]]:
+        return self.candidate_blocks("p" + phone)
+
+    def order_blocks(self, order_number: str) -> List[Tuple[int, Optional[int]]]:
+        return self.candidate_blocks("o" + normalize_order(order_number))
+
+    def correlation_blocks(self, correlation_id: str) -> List[Tuple[int, Optional[int]]]:
+        return self.candidate_blocks("c" + correlation_id.lower())
+
+
+class TraceFilter(BlockFilter):
+    """Фильтры блоков loyaltyTrace.log по correlationId"""
+
+    suffix = "trace-blocks"
+
+    def iter_entries(self, f, cancel=None, progress=None):
+        return iter_trace_entries(f, cancel=cancel, progress=progress)
+
+    def block_keys(self, data: bytes) -> Set[str]:
+        return set(trace_entry_ids(data))
+
+    def entry_blocks(self, correlation_id: str) -> List[Tuple[int, Optional[int]]]:
+        return self.candidate_blocks(correlation_id.lower())
@@ -0,0 +1,765 @@
+# log_search.py — поиск по логам без загрузки файла целиком в память
+import csv
+import glob
+import gzip
+import mmap
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+# Размер блока чтения: память на поиск не зависит от размера файла
+CHUNK_SIZE = 4 * 1024 * 1024
+# Запись без заголовков длиннее этого режется по границе строки
+MAX_RECORD_SIZE = 1024 * 1024
+# Заголовок записи короче этого: недочитанный хвост блока сканируем повторно
+HEADER_LOOKBACK = 64
+
+# Для первой строки записи трассировки с диска читается не больше этого
+SUMMARY_READ_SIZE = 64 * 1024
+
+# Имена текущих логов; ротированные копии — full.log.1, full.log.2.gz и т. д.
+FULL_LOG_NAME = "full.log"
+TRACE_LOG_NAME = "loyaltyTrace.log"
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Запись full.log начинается со строки с отметкой времени
+RECORD_START = re.compile(rb'^\[?\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}', re.MULTILINE)
+
+# Запись loyaltyTrace.log начинается со строки "LoyaltyTrace:"
+TRACE_START = re.compile(rb'^LoyaltyTrace:', re.MULTILINE)
+TRACE_MARKER = b'LoyaltyTrace:'
+
+# Отметка времени в любой записи: в заголовке full.log или в теле записи трассировки
+TIMESTAMP_RE = re.compile(rb'(\d{4}-\d{2}-\d{2})[ T](\d{2}:\d{2}:\d{2})')
+# Отметка времени внутри записи трассировки ищется не дальше этого
+TIMESTAMP_LOOKAHEAD = 1024
+
+PHONE_RE = re.compile(rb'(?<!\d)[78]\d{10}(?!\d)')
+ORDER_RE = re.compile(rb'Order\s+([\w-]+)', re.IGNORECASE)
+CORRELATION_RE = re.compile(rb'CorrelationId:\s*([a-f0-9-]+)', re.IGNORECASE)
+# correlationId в записи трассировки: UUID или значение поля correlationId
+TRACE_ID_RE = re.compile(
+    rb'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
+    rb'|correlation_?id\W{1,4}([a-f0-9-]+)',
+    re.IGNORECASE
+)
+
+
+class SearchCancelled(Exception):
+    """Поиск прерван пользователем"""
+
+
+def check_cancelled(cancel):
+    if cancel is not None and cancel.is_set():
+        raise SearchCancelled()
+
+
+class ProgressMeter:
+    """Прогресс сканирования по байтам: скорость (байт/с) и оценка оставшегося времени"""
+
+    def __init__(self, total_bytes: int, callback, min_interval: float = 0.25):
+        self.total_bytes = total_bytes
+        self.callback = callback
+        self.min_interval = min_interval
+        self.started = time.monotonic()
+        self._last_report = 0.0
+
+    def update(self, done_bytes: int, force: bool = False):
+        """callback(done, total, rate, eta) не чаще раза в min_interval секунд"""
+        now = time.monotonic()
+        if not force and now - self._last_report < self.min_interval:
+            return
+        self._last_report = now
+        elapsed = now - self.started
+        rate = done_bytes / elapsed if elapsed > 0 else 0.0
+        eta = (self.total_bytes - done_bytes) / rate if rate > 0 else None
+        self.callback(done_bytes, self.total_bytes, rate, eta)
+
+
+class LogRecord(NamedTuple):
+    offset: int
+    length: int
+    phones: Tuple[str, ...]
+    orders: Tuple[str, ...]
+    correlation_id: Optional[str]
+
+
+def normalize_phone(phone_input: str) -> str:
+    """Номер в виде 7XXXXXXXXXX: 10 цифр или 11 цифр с 7 или 8 в начале"""
+    digits_only_input = re.sub(r'\D', '', phone_input)
+
+    if len(digits_only_input) == 11:
+        if digits_only_input.startswith('8'):
+            return '7' + digits_only_input[1:]
+        if digits_only_input.startswith('7'):
+            return digits_only_input
+        raise ValueError("Введите корректный номер (11 цифр, начинающийся с 7 или 8)")
+    if len(digits_only_input) == 10:
+        return '7' + digits_only_input
+    raise ValueError("Введите корректный номер (10 или 11 цифр)")
+
+
+def normalize_order(order_number: str) -> str:
+    return order_number.strip().upper()
+
+
+def normalize_time(text: str, upper: bool = False) -> str:
+    """Граница периода в виде ГГГГ-ММ-ДД ЧЧ:ММ:СС; недостающее дополняется началом или концом (upper)"""
+    match = re.fullmatch(r'(\d{4}-\d{2}-\d{2})(?:[ T](\d{2}:\d{2})(:\d{2})?)?', text.strip())
+    if not match:
+        raise ValueError("Время в формате ГГГГ-ММ-ДД, ГГГГ-ММ-ДД ЧЧ:ММ или ГГГГ-ММ-ДД ЧЧ:ММ:СС")
+    date, minutes, seconds = match.groups()
+    if minutes is None:
+        minutes = "23:59" if upper else "00:00"
+    if seconds is None:
+        seconds = ":59" if upper else ":00"
+    return f"{date} {minutes}{seconds}"
+
+
+def entry_timestamp(data: bytes) -> Optional[str]:
+    """Первая отметка времени записи в виде ГГГГ-ММ-ДД ЧЧ:ММ:СС"""
+    match = TIMESTAMP_RE.search(data, 0, TIMESTAMP_LOOKAHEAD)
+    return f"{match.group(1).decode('ascii')} {match.group(2).decode('ascii')}" if match else None
+
+
+def within(entries: Iterable[Tuple[int, bytes]], since: Optional[str] = None,
+           until: Optional[str] = None) -> Iterable[Tuple[int, bytes]]:
+    """Записи с отметкой времени в [since, until]; записи без отметки не отбрасываются"""
+    if since is None and until is None:
+        return entries
+    return (entry for entry in entries if in_period(entry_timestamp(entry[1]), since, until))
+
+
+def in_period(stamp: Optional[str], since: Optional[str], until: Optional[str]) -> bool:
+    return stamp is None or ((since is None or stamp >= since) and (until is None or stamp <= until))
+
+
+# === Наборы ротированных логов ===
+
+def is_gzip(path) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(2) == GZIP_MAGIC
+
+
+@contextmanager
+def open_log(path, progress=None):
+    """Лог для потокового чтения: (поток, progress); .gz распаковывается на лету.
+
+    progress получает байты, прочитанные из файла на диске, а не распакованные,
+    чтобы прогресс сходился с размером файла.
+    """
+    with open(path, 'rb') as raw:
+        if raw.read(2) != GZIP_MAGIC:
+            raw.seek(0)
+            yield raw, progress
+            return
+        raw.seek(0)
+        with gzip.GzipFile(fileobj=raw) as f:
+            yield f, (None if progress is None else lambda _: progress(raw.tell()))
+
+
+def _rotation_number(path: Path) -> int:
+    match = re.search(r'\.(\d+)(?:\.gz)?$', path.name)
+    return int(match.group(1)) if match else 0
+
+
+def expand_log_set(spec, base_name: str) -> List[Path]:
+    """Файлы лога от нового к старому по пути к файлу, папке или маске.
+
+    В папке берутся base_name и его ротированные копии (base_name.1,
+    base_name.2.gz, base_name.2026-10-17.gz). Порядок — по времени
+    изменения, при равном времени меньший номер ротации новее.
+    """
+    spec = str(spec)
+    if os.path.isdir(spec):
+        member = re.compile(re.escape(base_name) + r'(?:\.[\d-]+)?(?:\.gz)?', re.IGNORECASE)
+        paths = [p for p in Path(spec).iterdir() if p.is_file() and member.fullmatch(p.name)]
+    elif re.search(r'[*?[]', spec):
+        paths = [Path(p) for p in glob.glob(spec) if os.path.isfile(p)]
+    else:
+        return [Path(spec)]
+    if not paths:
+        raise FileNotFoundError(f"Не найдено файлов {base_name}: {spec}")
+    return sorted(paths, key=lambda p: (-p.stat().st_mtime_ns, _rotation_number(p)))
+
+
+def iter_records(f, start_pattern=RECORD_START, chunk_size: int = CHUNK_SIZE,
+                 cancel=None, progress=None, end: Optional[int] = None) -> Iterator[Tuple[int, bytes]]:
+    """Делит бинарный поток на записи: (смещение, байты записи).
+
+    Запись начинается со строки, подходящей под start_pattern, и длится
+    до следующей такой строки. Текст до первого заголовка — отдельная запись.
+    Чтение идёт с текущей позиции f до end (по умолчанию до конца файла).
+    cancel (threading.Event) проверяется перед чтением каждого блока,
+    progress получает число байтов, прочитанных с начала сканирования.
+    """
+    buffer = b''
+    buffer_offset = start = f.tell()
+    scan_from = 1
+
+    while True:
+        check_cancelled(cancel)
+        if end is None:
+            chunk = f.read(chunk_size)
+        else:
+            chunk = f.read(max(0, min(chunk_size, end - buffer_offset - len(buffer))))
+        eof = not chunk
+        buffer += chunk
+        if progress is not None:
+            progress(buffer_offset + len(buffer) - start)
+
+        record_start = 0
+        for match in start_pattern.finditer(buffer, scan_from):
+            yield buffer_offset + record_start, buffer[record_start:match.start()]
+            record_start = match.start()
+
+        if eof:
+            if record_start < len(buffer):
+                yield buffer_offset + record_start, buffer[record_start:]
+            return
+
+        # Лог без заголовков не должен копиться в памяти целиком
+        if len(buffer) - record_start > MAX_RECORD_SIZE:
+            cut = buffer.rfind(b'\n', record_start, len(buffer) - HEADER_LOOKBACK) + 1
+            if cut > record_start:
+                yield buffer_offset + record_start, buffer[record_start:cut]
+                record_start = cut
+
+        buffer = buffer[record_start:]
+        buffer_offset += record_start
+        scan_from = max(1, len(buffer) - HEADER_LOOKBACK)
+
+
+def iter_records_reversed(f, start_pattern=RECORD_START, chunk_size: int = CHUNK_SIZE,
+                          cancel=None, progress=None, start: int = 0,
+                          end: Optional[int] = None) -> Iterator[Tuple[int, bytes]]:
+    """Те же записи, что и iter_records, но от конца файла к началу.
+
+    Файл читается блоками назад, поэтому поиск последнего совпадения
+    останавливается на первой подходящей записи и не дочитывает файл.
+    start — начало записи, раньше которого файл не читается; end — начало
+    записи, с которого (не включая) начинается обратный обход.
+    """
+    if end is None:
+        f.seek(0, 2)
+        end = f.tell()
+    position = end
+    tail = b''
+
+    while position > start:
+        check_cancelled(cancel)
+        read_size = min(chunk_size, position - start)
+        position -= read_size
+        f.seek(position)
+        buffer = f.read(read_size) + tail
+        if progress is not None:
+            progress(end - position)
+
+        # Начало буфера — начало строки, только если это start
+        starts = [m.start() for m in start_pattern.finditer(buffer, 0 if position == start else 1)]
+        record_end = len(buffer)
+        for record_start in reversed(starts):
+            yield position + record_start, buffer[record_start:record_end]
+            record_end = record_start
+        tail = buffer[:record_end]
+
+        # Лог без заголовков не должен копиться в памяти целиком
+        if len(tail) > MAX_RECORD_SIZE:
+            cut = tail.find(b'\n', len(tail) - MAX_RECORD_SIZE) + 1
+            if 0 < cut < len(tail):
+                yield position + cut, tail[cut:]
+                tail = tail[:cut]
+
+    if tail:
+        yield start, tail
+
+
+def parse_record(offset: int, data: bytes) -> LogRecord:
+    """Достаёт из записи full.log телефоны, номера заказов и correlationId"""
+    phones = tuple(dict.fromkeys('7' + m[1:].decode('ascii') for m in PHONE_RE.findall(data)))
+    orders = tuple(dict.fromkeys(
+        normalize_order(m.decode('ascii')) for m in ORDER_RE.findall(data)
+    ))
+    cid_match = CORRELATION_RE.search(data)
+    correlation_id = cid_match.group(1).decode('ascii') if cid_match else None
+    return LogRecord(offset, len(data), phones, orders, correlation_id)
+
+
+def _key_filter(phone: Optional[str], order_number: Optional[str]):
+    if phone is not None:
+        return re.compile(rb'[78]' + re.escape(phone[1:].encode('ascii')))
+    return re.compile(re.escape(normalize_order(order_number).encode('utf-8')), re.IGNORECASE)
+
+
+def matching_records(records: Iterable[Tuple[int, bytes]], phone: Optional[str] = None,
+                      order_number: Optional[str] = None) -> Iterator[LogRecord]:
+    """Записи с correlationId, где встречается телефон или заказ"""
+    key_filter = _key_filter(phone, order_number)
+    order_key = normalize_order(order_number) if order_number is not None else None
+
+    for offset, data in records:
+        # Дешёвая проверка до разбора записи
+        if not key_filter.search(data):
+            continue
+        record = parse_record(offset, data)
+        if not record.correlation_id:
+            continue
+        if (phone is not None and phone in record.phones) or (
+                order_key is not None and order_key in record.orders):
+            yield record
+
+
+def _last(items: Iterable):
+    item = None
+    for item in items:
+        pass
+    return item
+
+
+def find_last_record(path, phone: Optional[str] = None, order_number: Optional[str] = None,
+                     cancel=None, progress=None, start: int = 0, end: Optional[int] = None,
+                     since: Optional[str] = None, until: Optional[str] = None) -> Optional[LogRecord]:
+    """Последняя запись full.log с correlationId, где встречается телефон или заказ.
+
+    Скан идёт с конца файла (или с end) до start и завершается на первом
+    совпадении; since/until отбрасывают записи вне периода.
+    """
+    if is_gzip(path):
+        # gzip не читается с конца: архив проходится вперёд, запоминается последнее совпадение
+        with open_log(path, progress) as (f, log_progress):
+            f.seek(start)
+            records = iter_records(f, cancel=cancel, progress=log_progress, end=end)
+            return _last(matching_records(within(records, since, until), phone, order_number))
+
+    with open(path, 'rb') as f:
+        records = iter_records_reversed(f, cancel=cancel, progress=progress, start=start, end=end)
+        return next(matching_records(within(records, since, until), phone, order_number), None)
+
+
+# === Параллельный скан по диапазонам файла ===
+
+# Диапазон меньше этого не стоит отдельного процесса
+PARALLEL_MIN_RANGE = 16 * 1024 * 1024
+
+
+def split_ranges(path, parts: int, start_pattern=RECORD_START) -> List[Tuple[int, int]]:
+    """Делит файл на parts диапазонов [начало, конец), выровненных по началу записей"""
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, parts):
+            point = size * i // parts
+            if point <= bounds[-1]:
+                continue
+            # Байт перед точкой нужен, чтобы ^ не сработал посреди строки
+            f.seek(point - 1)
+            window = f.read(MAX_RECORD_SIZE + HEADER_LOOKBACK)
+            match = start_pattern.search(window, 1)
+            if match is not None and point - 1 + match.start() > bounds[-1]:
+                bounds.append(point - 1 + match.start())
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def scan_range(path, start: int, end: int, phone: Optional[str] = None,
+               order_number: Optional[str] = None) -> Optional[LogRecord]:
+    """Последняя подходящая запись в диапазоне [start, end); выполняется в дочернем процессе"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return _last(matching_records(iter_records(f, end=end), phone, order_number))
+
+
+def find_last_record_parallel(path, phone: Optional[str] = None, order_number: Optional[str] = None,
+                              cancel=None, progress=None, workers: Optional[int] = None) -> Optional[LogRecord]:
+    """То же, что find_last_record, но диапазоны файла сканируются в пуле процессов.
+
+    Побеждает совпадение из самого позднего диапазона, поэтому результаты
+    забираются с конца файла, а более ранние диапазоны после находки отменяются.
+    workers ограничивает число процессов (по умолчанию — все ядра).
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    size = os.path.getsize(path)
+    # Диапазонов больше, чем процессов: ранние можно отменить, нагрузка ровнее
+    parts = min(workers * 4, size // PARALLEL_MIN_RANGE)
+    if workers == 1 or parts < 2:
+        return find_last_record(path, phone, order_number, cancel, progress)
+
+    ranges = split_ranges(path, parts)
+    done_bytes = 0
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(scan_range, path, start, end, phone, order_number)
+                   for start, end in ranges]
+        for (start, end), future in zip(reversed(ranges), reversed(futures)):
+            while True:
+                check_cancelled(cancel)
+                try:
+                    record = future.result(timeout=0.2)
+                    break
+                except FutureTimeout:
+                    continue
+            done_bytes += end - start
+            if progress is not None:
+                progress(done_bytes)
+            if record is not None:
+                return record
+        return None
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_trace_entries(f, chunk_size: int = CHUNK_SIZE, cancel=None, progress=None,
+                       reverse: bool = False, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, bytes]]:
+    """Записи loyaltyTrace.log: (смещение, байты), каждая начинается с LoyaltyTrace:
+
+    Прямой обход идёт с текущей позиции f до end, обратный — от end (или конца) до start.
+    """
+    if reverse:
+        records = iter_records_reversed(f, TRACE_START, chunk_size, cancel, progress, start, end)
+    else:
+        records = iter_records(f, TRACE_START, chunk_size, cancel, progress, end)
+    for offset, data in records:
+        start = data.find(TRACE_MARKER)
+        if start < 0:
+            continue
+        yield offset + start, data[start:]
+
+
+def find_last_trace_entry(path, correlation_id: str, cancel=None, progress=None, start: int = 0,
+                          since: Optional[str] = None, end: Optional[int] = None) -> Optional[Tuple[int, bytes]]:
+    """Последняя запись loyaltyTrace.log с correlationId: скан с конца (или с end) до start или первого совпадения.
+
+    since отбрасывает записи раньше начала периода.
+    """
+    id_pattern = re.compile(re.escape(correlation_id.encode('ascii')), re.IGNORECASE)
+    if is_gzip(path):
+        with open_log(path, progress) as (f, log_progress):
+            f.seek(start)
+            entries = within(iter_trace_entries(f, cancel=cancel, progress=log_progress, end=end), since)
+            return _last(entry for entry in entries if id_pattern.search(entry[1]))
+
+    with open(path, 'rb') as f:
+        entries = iter_trace_entries(f, cancel=cancel, progress=progress, reverse=True, start=start, end=end)
+        for offset, data in within(entries, since):
+            if id_pattern.search(data):
+                return offset, data
+    return None
+
+
+def trace_entry_ids(data: bytes) -> Tuple[str, ...]:
+    """correlationId, упомянутые в записи трассировки, в нижнем регистре"""
+    return tuple(dict.fromkeys(
+        (m.group(1) or m.group(0)).decode('ascii').lower() for m in TRACE_ID_RE.finditer(data)
+    ))
+
+
+def trace_summary(data: bytes) -> str:
+    """Первая строка записи LoyaltyTrace без префикса"""
+    text = data.decode('utf-8', errors='ignore').strip()
+    return text.split("\n")[0].split("LoyaltyTrace:", 1)[-1].strip()
+
+
+def read_entry(path, offset: int, length: int) -> bytes:
+    """Одна запись лога по ссылке (смещение, длина); для .gz смещение в распакованном потоке"""
+    with open_log(path) as (f, _):
+        f.seek(offset)
+        return f.read(length)
+
+
+class TraceRef(NamedTuple):
+    """Запись loyaltyTrace.log по ссылке: первая строка сразу, тело — по запросу"""
+    path: str
+    offset: int
+    length: int
+    summary: str
+
+    def body(self) -> str:
+        """Запись целиком, прочитанная с диска"""
+        return read_entry(self.path, self.offset, self.length).decode('utf-8', errors='ignore').strip()
+
+
+def trace_ref(path, offset: int, length: int, data: Optional[bytes] = None) -> TraceRef:
+    """Ссылка на запись трассировки; первая строка берётся из data или читается с диска"""
+    if data is None:
+        data = read_entry(path, offset, min(length, SUMMARY_READ_SIZE))
+    return TraceRef(str(path), offset, length, trace_summary(data))
+
+
+def read_trace_refs(path, refs: Iterable[Tuple[int, int]]) -> List[TraceRef]:
+    """Ссылки с первой строкой на записи трассировки (смещение, длина): одно открытие файла.
+
+    Тела записей не читаются: только начало для первой строки.
+    """
+    refs = list(refs)
+    heads = read_entries(path, [(offset, min(length, SUMMARY_READ_SIZE)) for offset, length in refs])
+    return [trace_ref(path, offset, length, head) for (offset, length), head in zip(refs, heads)]
+
+
+def read_entries(path, refs: Iterable[Tuple[int, int]]) -> List[bytes]:
+    """Записи по ссылкам (смещение, длина) за одно открытие файла, в порядке refs.
+
+    Читаются по возрастанию смещения, чтобы .gz распаковывался один раз.
+    """
+    refs = list(refs)
+    entries = [b''] * len(refs)
+    with open_log(path) as (f, _):
+        for i in sorted(range(len(refs)), key=lambda i: refs[i][0]):
+            f.seek(refs[i][0])
+            entries[i] = f.read(refs[i][1])
+    return entries
+
+
+def record_timestamp(data: bytes) -> Optional[str]:
+    """Отметка времени из заголовка записи full.log"""
+    match = RECORD_START.match(data)
+    return match.group(0).lstrip(b'[').decode('ascii') if match else None
+
+
+# === Поиск по отображённому в память файлу (mmap) ===
+
+@contextmanager
+def mapped_file(path):
+    """Файл, отображённый в память только для чтения; для пустого файла — None"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield None
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
+def _record_bounds(mm, pos: int, start_pattern) -> Tuple[int, int]:
+    """Границы записи, содержащей байт pos: от её заголовка до следующего"""
+    limit = max(0, pos - MAX_RECORD_SIZE)
+    start = mm.rfind(b'\n', 0, pos) + 1
+    while start > limit and not start_pattern.match(mm, start):
+        start = mm.rfind(b'\n', 0, start - 1) + 1
+
+    line_end = mm.find(b'\n', pos)
+    if line_end < 0:
+        return start, len(mm)
+    next_header = start_pattern.search(mm, line_end + 1, line_end + 1 + MAX_RECORD_SIZE)
+    return start, next_header.start() if next_header else min(len(mm), line_end + 1 + MAX_RECORD_SIZE)
+
+
+def _rfind_any(mm, needles: Iterable[bytes], end: int) -> int:
+    return max(mm.rfind(needle, 0, end) for needle in needles)
+
+
+def _rfind_pattern(mm, pattern, width: int, end: int) -> int:
+    """Начало последнего совпадения pattern длиной width байтов, целиком лежащего до end, или -1.
+
+    re не умеет искать с конца, поэтому отображение просматривается окнами
+    по CHUNK_SIZE от end к началу; соседние окна перекрываются на width - 1 байт.
+    """
+    while end > 0:
+        start = max(0, end - CHUNK_SIZE)
+        found = -1
+        for match in pattern.finditer(mm, start, end):
+            found = match.start()
+        if found >= 0 or start == 0:
+            return found
+        end = start + width - 1
+    return -1
+
+
+def find_last_record_mmap(path, phone: Optional[str] = None, order_number: Optional[str] = None,
+                          cancel=None, progress=None) -> Optional[LogRecord]:
+    """То же, что find_last_record, но поиском байтов прямо в отображённом файле.
+
+    Ключ ищется с конца отображённого файла без чтения и декодирования всего
+    файла; копируется и разбирается только запись вокруг найденного вхождения.
+    """
+    order_key = normalize_order(order_number) if order_number is not None else None
+    if phone is not None:
+        # Без первой цифры: в логе номер может быть записан и через 7, и через 8
+        needles = {phone[1:].encode('ascii')}
+
+        def rfind(mm, end):
+            return _rfind_any(mm, needles, end)
+    else:
+        # Номер заказа в логе может быть записан в любом регистре: rfind тут не годится
+        key = order_key.encode('utf-8')
+        pattern = re.compile(re.escape(key), re.IGNORECASE)
+
+        def rfind(mm, end):
+            return _rfind_pattern(mm, pattern, len(key), end)
+
+    with mapped_file(path) as mm:
+        if mm is None:
+            return None
+        pos = rfind(mm, len(mm))
+        while pos >= 0:
+            check_cancelled(cancel)
+            start, stop = _record_bounds(mm, pos, RECORD_START)
+            if progress is not None:
+                progress(len(mm) - start)
+            record = parse_record(start, mm[start:stop])
+            if record.correlation_id and (
+                (phone is not None and phone in record.phones)
+                or (order_key is not None and order_key in record.orders)
+            ):
+                return record
+            pos = rfind(mm, start)
+    return None
+
+
+def find_last_trace_entry_mmap(path, correlation_id: str, cancel=None,
+                               progress=None) -> Optional[Tuple[int, bytes]]:
+    """То же, что find_last_trace_entry, но поиском байтов в отображённом файле"""
+    raw_id = correlation_id.encode('ascii')
+    pattern = re.compile(re.escape(raw_id), re.IGNORECASE)
+
+    with mapped_file(path) as mm:
+        if mm is None:
+            return None
+        pos = _rfind_pattern(mm, pattern, len(raw_id), len(mm))
+        while pos >= 0:
+            check_cancelled(cancel)
+            start, stop = _record_bounds(mm, pos, TRACE_START)
+            if progress is not None:
+                progress(len(mm) - start)
+            marker = mm.find(TRACE_MARKER, start, stop)
+            if 0 <= marker < pos:
+                return marker, mm[marker:stop]
+            pos = _rfind_pattern(mm, pattern, len(raw_id), start)
+    return None
+
+
+# === Пакетный поиск по списку телефонов или заказов ===
+
+def read_key_list(path) -> List[str]:
+    """Значения из первой непустой колонки CSV или TXT-списка"""
+    with open(path, encoding='utf-8-sig', errors='ignore', newline='') as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        keys = []
+        for row in csv.reader(f, dialect):
+            cells = [cell.strip() for cell in row if cell.strip()]
+            if cells:
+                keys.append(cells[0])
+    return keys
+
+
+def bulk_find_records(path, phones: Set[str] = frozenset(), orders: Set[str] = frozenset(),
+                      cancel=None, progress=None, start: int = 0) -> Dict[str, LogRecord]:
+    """Последняя запись с correlationId для каждого телефона и заказа за один проход.
+
+    Телефоны и номера заказов извлекаются из записи один раз и проверяются
+    по множеству искомых ключей, поэтому стоимость прохода не зависит от
+    длины списка. orders должны быть нормализованы normalize_order.
+    Проход начинается с записи по смещению start.
+    """
+    found = {}
+    with open_log(path, progress) as (f, progress):
+        f.seek(start)
+        for offset, data in iter_records(f, cancel=cancel, progress=progress):
+            record = parse_record(offset, data)
+            if not record.correlation_id:
+                continue
+            for phone in record.phones:
+                if phone in phones:
+                    found[phone] = record
+            for order in record.orders:
+                if order in orders:
+                    found[order] = record
+    return found
+
+
+def bulk_find_trace_entries(path, correlation_ids: Set[str], cancel=None, progress=None,
+                            start: int = 0) -> Dict[str, Tuple[int, bytes]]:
+    """Последняя запись loyaltyTrace.log для каждого correlationId (в нижнем регистре) за один проход"""
+    found = {}
+    with open_log(path, progress) as (f, progress):
+        f.seek(start)
+        for offset, data in iter_trace_entries(f, cancel=cancel, progress=progress):
+            for correlation_id in trace_entry_ids(data):
+                if correlation_id in correlation_ids:
+                    found[correlation_id] = (offset, data)
+    return found
+
+
+def write_bulk_csv(path, rows: Iterable[Tuple[str, Optional[str], Optional[str]]]):
+    """Таблица результатов пакетного поиска: ключ; correlationId; LoyaltyTrace"""
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(["Ключ", "CorrelationId", "LoyaltyTrace"])
+        for key, correlation_id, trace in rows:
+            writer.writerow([key, correlation_id or "", trace or ""])
+
+
+# === Слежение за дописываемым логом ===
+
+class LogFollower:
+    """Отдаёт только записи, дописанные в лог с прошлого опроса (как tail -f).
+
+    Последняя запись файла может ещё дописываться, поэтому она придерживается
+    до появления следующего заголовка; если файл не растёт целый опрос,
+    она отдаётся как есть и повторяется, только если потом удлинится.
+    Уменьшение файла или смена inode (ротация) — чтение нового файла с начала.
+    """
+
+    def __init__(self, path, start_pattern=RECORD_START, from_end: bool = True):
+        self.path = path
+        self.start_pattern = start_pattern
+        self.inode = None
+        self.position = 0  # сколько байтов файла уже прочитано
+        self.record_start = 0  # начало придержанной последней записи
+        self._reported = (0, 0)  # (смещение, длина) последней отданной незавершённой записи
+        self._idle_at = None  # размер, при котором простой уже обработан
+        if from_end:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                return
+            self.inode = st.st_ino
+            self.position = self.record_start = self._idle_at = st.st_size
+
+    def poll(self, cancel=None) -> List[Tuple[int, bytes]]:
+        """Новые записи (смещение, байты); стоимость пропорциональна дописанным байтам"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            # Между переименованием и созданием нового файла при ротации
+            return []
+        if self.inode is not None and (st.st_ino != self.inode or st.st_size < self.position):
+            print(f"[DEBUG] {self.path} обрезан или заменён при ротации, читаем с начала", file=sys.stderr)
+            self.position = self.record_start = 0
+            self._reported = (0, 0)
+            self._idle_at = None
+        self.inode = st.st_ino
+
+        idle = st.st_size == self.position
+        if idle and self._idle_at == st.st_size:
+            return []
+        if idle:
+            self._idle_at = st.st_size
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.record_start)
+            records = list(iter_records(f, self.start_pattern, cancel=cancel, end=st.st_size))
+        self.position = st.st_size
+        if not records:
+            return []
+
+        last_offset, last = records[-1]
+        new_records = records[:-1]
+        self.record_start = last_offset
+        if idle and last.endswith(b'\n'):
+            new_records.append(records[-1])
+        # Запись, уже отданная по простою, повторяется, только если удлинилась
+        reported_offset, reported_length = self._reported
+        new_records = [(offset, data) for offset, data in new_records
+                       if offset != reported_offset or len(data) > reported_length]
+        if idle and new_records and new_records[-1][0] == last_offset:
+            self._reported = (last_offset, len(last))
+        return new_records
@@ -0,0 +1,807 @@
+# loyalty_analyzer.py — поиск по логам лояльности без GUI и командная строка к нему
+#
+#   python loyalty_analyzer.py search --phone 79991234567 --full full.log --trace loyaltyTrace.log --json
+#   python loyalty_analyzer.py bulk --list phones.csv --full full.log --trace loyaltyTrace.log --out result.csv
+#   python loyalty_analyzer.py timeline --phone 79991234567 --full full.log --trace loyaltyTrace.log --limit 20
+#   python loyalty_analyzer.py index --full full.log --trace loyaltyTrace.log
+#   python loyalty_analyzer.py search --order A-1 --full /var/log/app --trace '/var/log/app/loyaltyTrace.log*'
+import argparse
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from log_index import FullLogFilter, FullLogIndex, TraceFilter, TraceIndex, store as index_store
+from log_search import (
+    FULL_LOG_NAME, HEADER_LOOKBACK, TIMESTAMP_LOOKAHEAD, TRACE_LOG_NAME, TRACE_MARKER, LogRecord, ProgressMeter,
+    SearchCancelled, TraceRef, bulk_find_records, bulk_find_trace_entries, entry_timestamp, expand_log_set,
+    find_last_record, find_last_record_mmap, find_last_record_parallel, find_last_trace_entry,
+    find_last_trace_entry_mmap, in_period, is_gzip, iter_records, iter_trace_entries, matching_records,
+    normalize_order, normalize_phone, normalize_time, parse_record, read_entries, read_key_list,
+    read_trace_refs, record_timestamp, trace_entry_ids, trace_ref, trace_summary, within, write_bulk_csv
+)
+
+MB = 1024 * 1024
+# Сколько последних результатов поиска помнить в памяти процесса
+QUERY_CACHE_SIZE = 256
+# Недоиндексированный хвост больше этого — повод дописать индекс в фоне
+INDEX_TAIL_LIMIT = 4 * MB
+
+# Способы скана лога, когда готового индекса ещё нет
+SCAN_MODES = {
+    "mmap": "Обратный скан через mmap",
+    "stream": "Обратный потоковый скан",
+    "parallel": "Параллельный скан на всех ядрах",
+}
+
+
+def format_progress(done: int, total: int, rate: float, eta) -> str:
+    """Строка статуса: прочитано, скорость и оставшееся время"""
+    text = f"Прочитано {done / MB:.1f} из {total / MB:.1f} МБ · {rate / MB:.1f} МБ/с"
+    if eta is not None:
+        text += f" · осталось ~{int(eta) // 60}:{int(eta) % 60:02d}"
+    return text
+
+
+class SearchResult(NamedTuple):
+    correlation_id: Optional[str]
+    trace: Optional[TraceRef]  # ссылка на запись LoyaltyTrace или None
+
+
+class TimelineEntry(NamedTuple):
+    timestamp: Optional[str]
+    correlation_id: str
+    traces: Tuple[TraceRef, ...]  # записи LoyaltyTrace с этим correlationId, от новых к старым
+
+
+class Timeline:
+    """Все записи full.log по телефону или заказу, от новых к старым, страницами.
+
+    Держит только списки (смещение, correlationId) из индексов; отметки
+    времени и записи трассировки читаются с диска для запрошенной страницы.
+    """
+
+    def __init__(self, full_parts, trace_parts):
+        # [(путь, [(смещение, correlationId)] в порядке файла)] от нового файла к старому
+        self._full_parts = [(path, entries) for path, entries in full_parts if entries]
+        # [(путь, [correlationId в нижнем регистре → [(смещение, длина)]] от новых к старым)]
+        # от нового файла к старому
+        self._trace_parts = trace_parts
+        self.total = sum(len(entries) for _, entries in self._full_parts)
+
+    def __len__(self) -> int:
+        return self.total
+
+    def page(self, start: int, count: int) -> List[TimelineEntry]:
+        """count записей, начиная с start-й с конца истории"""
+        refs = []  # (путь, смещение, correlationId) от новых к старым
+        skip = start
+        for path, entries in self._full_parts:
+            if len(refs) >= count:
+                break
+            if skip >= len(entries):
+                skip -= len(entries)
+                continue
+            stop = len(entries) - skip
+            taken = entries[max(0, stop - (count - len(refs))):stop]
+            refs.extend((path, offset, correlation_id) for offset, correlation_id in reversed(taken))
+            skip = 0
+
+        timestamps = {}
+        for path in dict.fromkeys(path for path, _, _ in refs):
+            offsets = [offset for ref_path, offset, _ in refs if ref_path == path]
+            headers = read_entries(path, [(offset, HEADER_LOOKBACK) for offset in offsets])
+            timestamps.update(((path, offset), record_timestamp(header)) for offset, header in zip(offsets, headers))
+
+        traces = self._traces({correlation_id.lower() for _, _, correlation_id in refs})
+        return [TimelineEntry(timestamps[(path, offset)], correlation_id, traces.get(correlation_id.lower(), ()))
+                for path, offset, correlation_id in refs]
+
+    def _traces(self, correlation_ids) -> Dict[str, Tuple[TraceRef, ...]]:
+        """Ссылки на записи трассировки для correlationId страницы: по одному чтению на файл"""
+        traces: Dict[str, Tuple[TraceRef, ...]] = {}
+        for path, ref_maps in self._trace_parts:
+            wanted = [(cid, ref) for cid in correlation_ids
+                      for refs in ref_maps for ref in reversed(refs.get(cid, []))]
+            if not wanted:
+                continue
+            for (cid, _), ref in zip(wanted, read_trace_refs(path, [ref for _, ref in wanted])):
+                traces[cid] = traces.get(cid, ()) + (ref,)
+        return traces
+
+
+class CorrelationRecord(NamedTuple):
+    path: str
+    timestamp: Optional[str]
+    summary: str  # первая строка записи full.log
+    record: LogRecord
+
+
+class CorrelationLookup(NamedTuple):
+    """Всё, что связано с одним correlationId в обоих логах, от новых записей к старым"""
+    correlation_id: str
+    phones: Tuple[str, ...]
+    orders: Tuple[str, ...]
+    records: List[CorrelationRecord]
+    traces: List[TraceRef]
+
+
+class QueryCache:
+    """Результаты поисков в памяти процесса с вытеснением давно не использованных (LRU)"""
+
+    def __init__(self, max_entries: int = QUERY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, object]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Tuple[bool, object]:
+        """(найден ли, значение); None тоже кэшируется — «не найдено» в неизменных логах"""
+        with self._lock:
+            if key not in self._entries:
+                return False, None
+            self._entries.move_to_end(key)
+            return True, self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Общий кэш всех анализаторов процесса: GUI создаёт новый на каждый поиск
+query_cache = QueryCache()
+
+
+class LogAnalyzer:
+    """Поиск по паре логов full.log + loyaltyTrace.log.
+
+    Каждый лог задаётся файлом, папкой с ротированными копиями или маской;
+    файлы набора просматриваются от нового к старому до первого совпадения.
+    Если индекс файла уже построен, ответ берётся из него; если есть
+    только фильтры блоков, сканируются лишь блоки, где ключ может быть;
+    иначе файл сканируется способом scan_mode (архивы .gz — только потоком).
+    used_scan показывает, что индекса не было. Ответы запоминаются в
+    query_cache по запросу и отпечатку всех файлов обоих логов.
+
+    since/until (ГГГГ-ММ-ДД ЧЧ:ММ:СС) ограничивают поиск и историю
+    периодом: индекс времени файла сужает скан до нужного куска, записи
+    трассировки ищутся не раньше since.
+    """
+
+    def __init__(self, full_log_path, trace_log_path, scan_mode: str = "mmap", max_workers=None,
+                 since: Optional[str] = None, until: Optional[str] = None):
+        self.full_log_path = full_log_path
+        self.trace_log_path = trace_log_path
+        self.full_logs = expand_log_set(full_log_path, FULL_LOG_NAME)
+        self.trace_logs = expand_log_set(trace_log_path, TRACE_LOG_NAME)
+        self.scan_mode = scan_mode
+        self.max_workers = max_workers
+        self.used_scan = False
+        self.cache = query_cache
+        self.since = since
+        self.until = until
+
+    def fingerprint(self) -> tuple:
+        """Путь, размер, время изменения и inode каждого файла обоих логов"""
+        fingerprint = []
+        for path in self.full_logs + self.trace_logs:
+            st = os.stat(path)
+            fingerprint.append((str(path), st.st_size, st.st_mtime_ns, st.st_ino))
+        return tuple(fingerprint)
+
+    def _cached(self, query: tuple, compute):
+        """Ответ на запрос из кэша, пока ни один файл логов не менялся, иначе compute()"""
+        key = (query, (self.since, self.until), self.fingerprint())
+        hit, value = self.cache.get(key)
+        if not hit:
+            value = compute()
+            self.cache.put(key, value)
+        return value
+
+    def log_sizes(self) -> Tuple[int, int]:
+        """Размер на диске всех файлов full.log и всех файлов loyaltyTrace.log"""
+        return (sum(os.path.getsize(path) for path in self.full_logs),
+                sum(os.path.getsize(path) for path in self.trace_logs))
+
+    @staticmethod
+    def _each_log(paths, progress, done: int = 0):
+        """(путь, progress файла) от нового к старому; прогресс копится по всему набору"""
+        for path in paths:
+            if progress is None:
+                yield path, None
+            else:
+                yield path, lambda n, base=done: progress(base + n)
+            done += os.path.getsize(path)
+
+    def _scan(self, streaming, mapped, path, *args, **kwargs):
+        """Скан через mmap, если он не отключён и доступен, иначе потоковым чтением"""
+        if self.scan_mode != "stream" and not is_gzip(path):
+            try:
+                return mapped(path, *args, **kwargs)
+            except (OSError, ValueError, OverflowError) as e:
+                # Например, сетевой диск без поддержки mmap или 32-битный Python
+                print(f"[DEBUG] mmap недоступен, потоковое чтение: {e}", file=sys.stderr)
+        return streaming(path, *args, **kwargs)
+
+    def _index_tail(self, index, path) -> int:
+        """Начало недоиндексированного хвоста файла или -1, если хвоста нет"""
+        tail = index.unindexed(path)
+        if tail > INDEX_TAIL_LIMIT:
+            self.used_scan = True
+        return index.size if tail else -1
+
+    @staticmethod
+    def _ready_index(index_class, filter_class, path, cancel, progress):
+        """(индекс, фильтры блоков) файла: готовый индекс или, если его нет, фильтры.
+
+        Пока индекс строится в фоне, поиск не ждёт его, а берёт фильтры:
+        они строятся первым быстрым проходом, и их дождаться недолго.
+        """
+        if index_class.building(path):
+            return None, filter_class.open(path, cancel, progress)
+        index = index_class.cached(path)
+        return index, (filter_class.cached(path) if index is None else None)
+
+    def _idle_index(self, index_class, path):
+        """Готовый индекс файла, если его сейчас не дописывают в фоне, иначе None.
+
+        В дописываемый индекс update добавляет строки таблиц, пока их читают:
+        такой файл сканируется, как и без индекса.
+        """
+        if index_class.building(path):
+            return None
+        index = index_class.cached(path)
+        if index is None:
+            self.used_scan = True
+        return index
+
+    def _filtered_scan(self, path, filters, key_blocks, start: int, find, progress):
+        """Последняя находка find(начало, конец, progress) в файле после start.
+
+        Без фильтров блоков файл сканируется от конца до start целиком, с ними —
+        только хвост после фильтров и блоки key_blocks(filters), где ключ может быть.
+        """
+        if filters is None or filters.size <= start:
+            return find(start, None, progress)
+        if filters.unindexed(path):
+            found = find(max(start, filters.size), None, progress)
+            if found:
+                return found
+        size = os.path.getsize(path)
+        for block_start, block_end in reversed(key_blocks(filters)):
+            if block_end is not None and block_end <= start:
+                break
+            block_progress = progress
+            if progress is not None and not filters.compressed:
+                # Прогресс — доля файла от конца, пройденная обратным сканом
+                block_progress = lambda done, block_end=block_end: progress(size - block_end + done)
+            found = find(max(start, block_start), block_end, block_progress)
+            if found:
+                return found
+        return None
+
+    def _has_period(self) -> bool:
+        return self.since is not None or self.until is not None
+
+    def _latest_in_period(self, path, items, start: int, end: Optional[int],
+                          since: Optional[str], until: Optional[str]) -> Optional[tuple]:
+        """Последний из (смещение, ...) индекса, чья запись попала в период; читает только заголовки"""
+        for item in reversed(items):
+            offset = item[0]
+            if end is not None and offset >= end:
+                continue
+            if offset < start:
+                break
+            if since is None and until is None:
+                return item
+            header = read_entries(path, [(offset, TIMESTAMP_LOOKAHEAD)])[0]
+            if in_period(entry_timestamp(header), since, until):
+                return item
+        return None
+
+    def _find_record(self, path, phone, order_number, cancel, progress) -> Optional[str]:
+        full_index, filters = self._ready_index(FullLogIndex, FullLogFilter, path, cancel, progress)
+
+        def find(start, end, scan_progress):
+            record = find_last_record(path, phone, order_number, cancel, scan_progress, start=start, end=end,
+                                      since=self.since, until=self.until)
+            return record.correlation_id if record else None
+
+        def key_blocks(block_filter):
+            return block_filter.phone_blocks(phone) if phone is not None else block_filter.order_blocks(order_number)
+
+        if full_index is not None:
+            start, end = full_index.window(self.since, self.until)
+            # Дописанное после построения индекса новее всего, что в нём есть;
+            # если период кончается внутри индекса, хвост смотреть незачем
+            tail = self._index_tail(full_index, path) if end is None else -1
+            if tail >= 0:
+                correlation_id = self._filtered_scan(path, FullLogFilter.cached(path), key_blocks,
+                                                     max(tail, start), find, progress)
+                if correlation_id:
+                    return correlation_id
+            entries = full_index.phone_entries(phone) if phone is not None else full_index.order_entries(order_number)
+            entry = self._latest_in_period(path, entries, start, end, self.since, self.until)
+            return entry[1] if entry else None
+
+        if not FullLogIndex.building(path):
+            self.used_scan = True
+        if filters is not None:
+            return self._filtered_scan(path, filters, key_blocks, 0, find, progress)
+        if self._has_period():
+            # Без индекса времени период только отсеивает записи: обычный обратный скан
+            return find(0, None, progress)
+        if self.scan_mode == "parallel" and not is_gzip(path):
+            record = find_last_record_parallel(path, phone, order_number, cancel, progress,
+                                               workers=self.max_workers)
+        else:
+            record = self._scan(find_last_record, find_last_record_mmap, path,
+                                phone, order_number, cancel, progress)
+        return record.correlation_id if record else None
+
+    def find_correlation_id(self, phone: Optional[str] = None, order_number: Optional[str] = None,
+                            cancel=None, progress=None) -> Optional[str]:
+        """Последний correlationId для телефона (7XXXXXXXXXX) или номера заказа"""
+        query = ("phone", phone) if phone is not None else ("order", normalize_order(order_number))
+        return self._cached(query, lambda: self._find_correlation_id(phone, order_number, cancel, progress))
+
+    def _find_correlation_id(self, phone, order_number, cancel, progress) -> Optional[str]:
+        for path, file_progress in self._each_log(self.full_logs, progress):
+            correlation_id = self._find_record(path, phone, order_number, cancel, file_progress)
+            if correlation_id:
+                return correlation_id
+        return None
+
+    def find_trace(self, correlation_id: str, cancel=None, progress=None) -> Optional[TraceRef]:
+        """Ссылка на последнюю запись LoyaltyTrace с этим correlationId"""
+        query = ("correlation_id", correlation_id.lower())
+        return self._cached(query, lambda: self._find_trace(correlation_id, cancel, progress))
+
+    def _find_trace(self, correlation_id: str, cancel, progress) -> Optional[TraceRef]:
+        for path, file_progress in self._each_log(self.trace_logs, progress):
+            trace_index, filters = self._ready_index(TraceIndex, TraceFilter, path, cancel, file_progress)
+
+            def find(start, end, scan_progress, path=path):
+                return find_last_trace_entry(path, correlation_id, cancel, scan_progress, start=start,
+                                             since=self.since, end=end)
+
+            def key_blocks(block_filter):
+                return block_filter.entry_blocks(correlation_id)
+
+            if trace_index is not None:
+                # Трассировка пишется после запроса: период ограничивает её только снизу
+                start, _ = trace_index.window(self.since)
+                tail = self._index_tail(trace_index, path)
+                if tail >= 0:
+                    found = self._filtered_scan(path, TraceFilter.cached(path), key_blocks,
+                                                max(tail, start), find, file_progress)
+                    if found:
+                        return trace_ref(path, found[0], len(found[1]), found[1])
+                ref = self._latest_in_period(path, trace_index.entry_refs(correlation_id), start, None,
+                                             self.since, None)
+                if ref:
+                    return trace_ref(path, *ref)
+                continue
+
+            if not TraceIndex.building(path):
+                self.used_scan = True
+            if filters is not None:
+                found = self._filtered_scan(path, filters, key_blocks, 0, find, file_progress)
+            elif self.since is not None:
+                found = find(0, None, file_progress)
+            else:
+                found = self._scan(find_last_trace_entry, find_last_trace_entry_mmap, path,
+                                   correlation_id, cancel, file_progress)
+            if found:
+                return trace_ref(path, found[0], len(found[1]), found[1])
+        return None
+
+    def search(self, phone: Optional[str] = None, order_number: Optional[str] = None,
+               cancel=None, progress=None) -> SearchResult:
+        """correlationId и запись LoyaltyTrace; progress(done, total, rate, eta) по обоим логам"""
+        full_size, trace_size = self.log_sizes()
+        meter = ProgressMeter(full_size + trace_size, progress or (lambda *args: None))
+
+        correlation_id = self.find_correlation_id(phone, order_number, cancel, meter.update)
+        if not correlation_id:
+            return SearchResult(None, None)
+        trace = self.find_trace(correlation_id, cancel, lambda done: meter.update(full_size + done))
+        meter.update(full_size + trace_size, force=True)
+        return SearchResult(correlation_id, trace)
+
+    def bulk_lookup(self, keys: List[str], by_order: bool = False, cancel=None,
+                    progress=None) -> List[Tuple[str, Optional[str], Optional[str]]]:
+        """(ключ, correlationId, LoyaltyTrace) для каждого нормализованного ключа списка.
+
+        В более старые файлы набора переходят только ещё не найденные ключи.
+        """
+        full_size, trace_size = self.log_sizes()
+        meter = ProgressMeter(full_size + trace_size, progress or (lambda *args: None))
+
+        correlation_ids = {}
+        for path, file_progress in self._each_log(self.full_logs, meter.update):
+            remaining = set(keys) - correlation_ids.keys()
+            if not remaining:
+                break
+            full_index = self._idle_index(FullLogIndex, path)
+            # Без индекса сканируется весь файл, с индексом — только недоиндексированный хвост
+            tail = 0 if full_index is None else self._index_tail(full_index, path)
+            if tail >= 0:
+                found = bulk_find_records(path, orders=remaining if by_order else frozenset(),
+                                          phones=frozenset() if by_order else remaining,
+                                          cancel=cancel, progress=file_progress, start=tail)
+                correlation_ids.update((key, record.correlation_id) for key, record in found.items())
+                remaining -= found.keys()
+            if full_index is not None:
+                lookup = full_index.latest_order if by_order else full_index.latest_phone
+                entries = {key: lookup(key) for key in remaining}
+                correlation_ids.update((key, entry[1]) for key, entry in entries.items() if entry)
+        meter.update(full_size, force=True)
+
+        wanted = {cid.lower() for cid in correlation_ids.values()}
+        traces = {}
+        for path, file_progress in self._each_log(self.trace_logs, meter.update, full_size):
+            remaining = wanted - traces.keys()
+            if not remaining:
+                break
+            trace_index = self._idle_index(TraceIndex, path)
+            tail = 0 if trace_index is None else self._index_tail(trace_index, path)
+            if tail >= 0:
+                found = bulk_find_trace_entries(path, remaining, cancel, file_progress, start=tail)
+                traces.update((cid, trace_summary(data)) for cid, (_, data) in found.items())
+                remaining -= found.keys()
+            if trace_index is not None:
+                refs = {cid: trace_index.latest(cid) for cid in remaining}
+                traces.update((cid, trace_ref(path, *ref).summary) for cid, ref in refs.items() if ref)
+        meter.update(full_size + trace_size, force=True)
+
+        rows = []
+        for key in keys:
+            correlation_id = correlation_ids.get(key)
+            rows.append((key, correlation_id, traces.get(correlation_id.lower()) if correlation_id else None))
+        return rows
+
+    def timeline(self, phone: Optional[str] = None, order_number: Optional[str] = None,
+                 cancel=None, progress=None) -> Timeline:
+        """История клиента: все записи с correlationId по телефону или заказу.
+
+        Индексы файлов строятся или дописываются при необходимости;
+        progress(done) получает байты, прочитанные из обоих логов.
+        """
+        full_size = sum(os.path.getsize(path) for path in self.full_logs)
+        full_parts = []
+        for path, file_progress in self._each_log(self.full_logs, progress):
+            full_index = FullLogIndex.open(path, cancel, file_progress)
+            entries = full_index.phone_entries(phone) if phone is not None else full_index.order_entries(order_number)
+            start, end = full_index.window(self.since, self.until)
+            if self._has_period():
+                entries = self._entries_in_period(path, entries, start, end)
+            if full_index.unindexed(path) and end is None:
+                with open(path, "rb") as f:
+                    f.seek(full_index.size)
+                    records = within(iter_records(f, cancel=cancel), self.since, self.until)
+                    tail = [(record.offset, record.correlation_id)
+                            for record in matching_records(records, phone, order_number)]
+                entries = entries + tail
+            full_parts.append((path, entries))
+
+        trace_parts = []
+        for path, file_progress in self._each_log(self.trace_logs, progress, full_size):
+            trace_index = TraceIndex.open(path, cancel, file_progress)
+            refs = [trace_index.entries]
+            if trace_index.unindexed(path):
+                # Последняя, ещё дописываемая запись: в общий индекс её не добавляем
+                tail = {}
+                with open(path, "rb") as f:
+                    f.seek(trace_index.size)
+                    for offset, data in iter_trace_entries(f, cancel=cancel):
+                        for correlation_id in trace_entry_ids(data):
+                            tail.setdefault(correlation_id, []).append((offset, len(data)))
+                refs.insert(0, tail)
+            trace_parts.append((path, refs))
+        return Timeline(full_parts, trace_parts)
+
+    def _entries_in_period(self, path, entries, start: int, end: Optional[int]):
+        """Записи индекса из куска [start, end), отметка времени которых попала в период"""
+        entries = [entry for entry in entries if entry[0] >= start and (end is None or entry[0] < end)]
+        headers = read_entries(path, [(offset, TIMESTAMP_LOOKAHEAD) for offset, _ in entries])
+        return [entry for entry, header in zip(entries, headers)
+                if in_period(entry_timestamp(header), self.since, self.until)]
+
+    def find_by_correlation_id(self, correlation_id: str, cancel=None, progress=None) -> CorrelationLookup:
+        """Записи full.log и loyaltyTrace.log с этим correlationId, телефоны и заказы из них.
+
+        Ответ берётся из обратных индексов (строятся или дописываются при
+        необходимости); сканируется только недоиндексированный хвост файла.
+        """
+        wanted = correlation_id.strip().lower()
+        full_size = sum(os.path.getsize(path) for path in self.full_logs)
+        records = []
+        for path, file_progress in self._each_log(self.full_logs, progress):
+            full_index = FullLogIndex.open(path, cancel, file_progress)
+            refs = list(full_index.correlation_refs(wanted))
+            if full_index.unindexed(path):
+                with open(path, "rb") as f:
+                    f.seek(full_index.size)
+                    for offset, data in iter_records(f, cancel=cancel):
+                        record = parse_record(offset, data)
+                        if record.correlation_id and record.correlation_id.lower() == wanted:
+                            refs.append((offset, len(data)))
+            refs.reverse()
+            for (offset, _), data in zip(refs, read_entries(path, refs)):
+                text = data.decode("utf-8", errors="ignore").strip()
+                records.append(CorrelationRecord(str(path), record_timestamp(data), text.split("\n")[0],
+                                                 parse_record(offset, data)))
+
+        traces = []
+        for path, file_progress in self._each_log(self.trace_logs, progress, full_size):
+            trace_index = TraceIndex.open(path, cancel, file_progress)
+            refs = list(trace_index.entry_refs(wanted))
+            if trace_index.unindexed(path):
+                with open(path, "rb") as f:
+                    f.seek(trace_index.size)
+                    refs.extend((offset, len(data)) for offset, data in iter_trace_entries(f, cancel=cancel)
+                                if wanted in trace_entry_ids(data))
+            traces.extend(read_trace_refs(path, reversed(refs)))
+
+        phones = tuple(dict.fromkeys(phone for item in records for phone in item.record.phones))
+        orders = tuple(dict.fromkeys(order for item in records for order in item.record.orders))
+        return CorrelationLookup(wanted, phones, orders, records, traces)
+
+    def build_indexes(self, cancel=None, progress=None):
+        """Строит индексы всех файлов обоих логов или дописывает в них новые записи"""
+        build_indexes(self.full_logs, self.trace_logs, cancel, progress)
+
+
+def build_indexes(full_logs, trace_logs, cancel=None, progress=None):
+    """Индексы файлов full.log и loyaltyTrace.log; progress(done) — байты обоих наборов подряд.
+
+    Логи читаются дважды: сначала быстрым проходом строятся фильтры блоков,
+    затем полные индексы, поэтому progress доходит до удвоенного размера
+    логов. Пока идёт построение, поиск по ещё не проиндексированному файлу
+    сканирует только блоки, допущенные фильтрами, а не весь файл.
+    """
+    full_size = sum(os.path.getsize(path) for path in full_logs)
+    total = full_size + sum(os.path.getsize(path) for path in trace_logs)
+    jobs = [(FullLogIndex, path) for path in full_logs] + [(TraceIndex, path) for path in trace_logs]
+    for index_class, path in jobs:
+        index_class.schedule(path)
+    try:
+        passes = ((FullLogFilter, TraceFilter, 0), (FullLogIndex, TraceIndex, total))
+        for full_class, trace_class, done in passes:
+            for path, file_progress in LogAnalyzer._each_log(full_logs, progress, done):
+                full_class.open(path, cancel, file_progress)
+            for path, file_progress in LogAnalyzer._each_log(trace_logs, progress, done + full_size):
+                trace_class.open(path, cancel, file_progress)
+    finally:
+        for index_class, path in jobs:
+            index_class.schedule(path, False)
+
+
+# === Командная строка ===
+
+def _print_progress(done, total, rate, eta):
+    print("\r" + format_progress(done, total, rate, eta), end="", file=sys.stderr, flush=True)
+
+
+def _bytes_meter(analyzer: LogAnalyzer, passes: int = 1) -> ProgressMeter:
+    """Прогресс в stderr для операций, сообщающих только прочитанные байты; passes — проходов по логам"""
+    return ProgressMeter(passes * sum(analyzer.log_sizes()), _print_progress)
+
+
+def _cmd_search(args, analyzer: LogAnalyzer) -> int:
+    if args.phone is not None:
+        query = {"phone": normalize_phone(args.phone)}
+    else:
+        query = {"order_number": args.order}
+    result = analyzer.search(**query, progress=_print_progress if args.progress else None)
+    if args.progress:
+        print(file=sys.stderr)
+
+    trace = result.trace.summary if result.trace else None
+    body = None
+    if result.trace and args.full_trace:
+        # Как и первая строка, тело выводится без префикса LoyaltyTrace:
+        body = result.trace.body().removeprefix(TRACE_MARKER.decode("ascii")).strip()
+    if args.json:
+        output = {
+            "phone": query.get("phone"),
+            "order": query.get("order_number"),
+            "correlation_id": result.correlation_id,
+            "loyalty_trace": trace,
+        }
+        if args.full_trace:
+            output["loyalty_trace_body"] = body
+        print(json.dumps(output, ensure_ascii=False))
+    else:
+        print(f"CorrelationId: {result.correlation_id or 'не найден'}")
+        print(f"LoyaltyTrace: {body or trace or 'не найдена'}")
+    return 0 if result.correlation_id else 1
+
+
+def _cmd_bulk(args, analyzer: LogAnalyzer) -> int:
+    by_order = args.type == "order"
+    keys, skipped = [], 0
+    for value in read_key_list(args.list):
+        if by_order:
+            keys.append(normalize_order(value))
+            continue
+        try:
+            keys.append(normalize_phone(value))
+        except ValueError:
+            skipped += 1
+    keys = list(dict.fromkeys(keys))
+    if skipped:
+        print(f"Пропущено некорректных строк: {skipped}", file=sys.stderr)
+
+    rows = analyzer.bulk_lookup(keys, by_order, progress=_print_progress if args.progress else None)
+    if args.progress:
+        print(file=sys.stderr)
+
+    if args.json:
+        print(json.dumps([{"key": key, "correlation_id": cid, "loyalty_trace": trace}
+                          for key, cid, trace in rows], ensure_ascii=False))
+    elif args.out:
+        write_bulk_csv(args.out, rows)
+    else:
+        for key, cid, trace in rows:
+            print(f"{key};{cid or ''};{trace or ''}")
+    return 0
+
+
+def _cmd_timeline(args, analyzer: LogAnalyzer) -> int:
+    if args.phone is not None:
+        query = {"phone": normalize_phone(args.phone)}
+    else:
+        query = {"order_number": args.order}
+    timeline = analyzer.timeline(**query, progress=_bytes_meter(analyzer).update if args.progress else None)
+    if args.progress:
+        print(file=sys.stderr)
+
+    entries = timeline.page(args.offset, args.limit)
+    if args.json:
+        print(json.dumps({
+            "total": len(timeline),
+            "entries": [{"timestamp": entry.timestamp, "correlation_id": entry.correlation_id,
+                         "loyalty_trace": [trace.summary for trace in entry.traces]} for entry in entries],
+        }, ensure_ascii=False))
+    else:
+        print(f"Записей: {len(timeline)}")
+        for entry in entries:
+            print(f"{entry.timestamp or '?'};{entry.correlation_id};{entry.traces[0].summary if entry.traces else ''}")
+    return 0 if len(timeline) else 1
+
+
+def _cmd_correlation(args, analyzer: LogAnalyzer) -> int:
+    result = analyzer.find_by_correlation_id(args.id, progress=_bytes_meter(analyzer).update if args.progress else None)
+    if args.progress:
+        print(file=sys.stderr)
+
+    if args.json:
+        print(json.dumps({
+            "correlation_id": result.correlation_id,
+            "phones": list(result.phones),
+            "orders": list(result.orders),
+            "records": [{"file": item.path, "offset": item.record.offset, "timestamp": item.timestamp,
+                         "summary": item.summary} for item in result.records],
+            "loyalty_trace": [{"file": trace.path, "offset": trace.offset, "summary": trace.summary}
+                              for trace in result.traces],
+        }, ensure_ascii=False))
+    else:
+        print(f"Телефоны: {', '.join(result.phones) or 'нет'}")
+        print(f"Заказы: {', '.join(result.orders) or 'нет'}")
+        for item in result.records:
+            print(f"full.log;{item.timestamp or '?'};{item.summary}")
+        for trace in result.traces:
+            print(f"LoyaltyTrace;;{trace.summary}")
+    return 0 if result.records or result.traces else 1
+
+
+def _cmd_index(args, analyzer: LogAnalyzer) -> int:
+    if args.cache_limit is not None:
+        index_store.set_limit(args.cache_limit * MB)
+    meter = _bytes_meter(analyzer, 2) if args.progress else None
+    analyzer.build_indexes(progress=meter.update if meter else None)
+    if meter:
+        # Последнее обновление могло быть пропущено по частоте: итог печатается всегда
+        meter.update(meter.total_bytes, force=True)
+        print(file=sys.stderr)
+    return 0
+
+
+def _period_bound(upper: bool):
+    """Тип аргумента argparse для границы периода"""
+    def parse(text):
+        try:
+            return normalize_time(text, upper)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+    return parse
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="loyalty-analyzer", description="Анализ логов лояльности")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_log_args(command):
+        command.add_argument("--full", required=True, help="full.log, папка с ротированными логами или маска")
+        command.add_argument("--trace", required=True, help="loyaltyTrace.log, папка с ротированными логами или маска")
+        command.add_argument("--scan-mode", choices=list(SCAN_MODES), default="mmap",
+                             help="способ скана, если индекса ещё нет")
+        command.add_argument("--workers", type=int, default=None,
+                             help="процессов для --scan-mode parallel (по умолчанию все ядра)")
+        command.add_argument("--progress", action="store_true", help="показывать прогресс в stderr")
+
+    def add_period_args(command):
+        command.add_argument("--from", dest="since", type=_period_bound(False), default=None,
+                             help="начало периода: ГГГГ-ММ-ДД[ ЧЧ:ММ[:СС]]")
+        command.add_argument("--to", dest="until", type=_period_bound(True), default=None,
+                             help="конец периода включительно: ГГГГ-ММ-ДД[ ЧЧ:ММ[:СС]]")
+
+    search = commands.add_parser("search", help="последний correlationId и LoyaltyTrace")
+    key = search.add_mutually_exclusive_group(required=True)
+    key.add_argument("--phone", help="номер телефона, 10 или 11 цифр")
+    key.add_argument("--order", help="номер заказа")
+    add_log_args(search)
+    add_period_args(search)
+    search.add_argument("--json", action="store_true", help="вывод в JSON")
+    search.add_argument("--full-trace", action="store_true", help="запись LoyaltyTrace целиком, а не первая строка")
+    search.set_defaults(handler=_cmd_search)
+
+    bulk = commands.add_parser("bulk", help="пакетный поиск по списку из CSV/TXT")
+    bulk.add_argument("--list", required=True, help="файл со списком телефонов или заказов")
+    bulk.add_argument("--type", choices=["phone", "order"], default="phone")
+    bulk.add_argument("--out", help="CSV для результатов (по умолчанию stdout)")
+    bulk.add_argument("--json", action="store_true", help="вывод в JSON")
+    add_log_args(bulk)
+    bulk.set_defaults(handler=_cmd_bulk)
+
+    timeline = commands.add_parser("timeline", help="вся история клиента: correlationId от новых к старым")
+    key = timeline.add_mutually_exclusive_group(required=True)
+    key.add_argument("--phone", help="номер телефона, 10 или 11 цифр")
+    key.add_argument("--order", help="номер заказа")
+    timeline.add_argument("--offset", type=int, default=0, help="сколько последних записей пропустить")
+    timeline.add_argument("--limit", type=int, default=50, help="сколько записей вывести")
+    add_log_args(timeline)
+    add_period_args(timeline)
+    timeline.add_argument("--json", action="store_true", help="вывод в JSON")
+    timeline.set_defaults(handler=_cmd_timeline)
+
+    correlation = commands.add_parser("correlation", help="телефоны, заказы и записи обоих логов по correlationId")
+    correlation.add_argument("--id", required=True, help="correlationId")
+    add_log_args(correlation)
+    correlation.add_argument("--json", action="store_true", help="вывод в JSON")
+    correlation.set_defaults(handler=_cmd_correlation)
+
+    index = commands.add_parser("index", help="построить индексы логов заранее")
+    add_log_args(index)
+    index.add_argument("--cache-limit", type=int, default=None,
+                       help="лимит места под индексы в кэше, МБ (сохраняется); старые индексы вытесняются")
+    index.set_defaults(handler=_cmd_index)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        # Набор логов раскрывается сразу: пустая папка или маска без файлов — ошибка, а не «не найдено»
+        analyzer = LogAnalyzer(args.full, args.trace, args.scan_mode, args.workers,
+                               since=getattr(args, "since", None), until=getattr(args, "until", None))
+        return args.handler(args, analyzer)
+    except (ValueError, OSError) as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 2
+    except (KeyboardInterrupt, SearchCancelled):
+        return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
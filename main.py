@@ -8,11 +8,69 @@ from pathlib import Path
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QWidget,
     QPushButton, QLabel, QLineEdit, QTextEdit, QFileDialog,
-    QProgressBar, QMessageBox, QGroupBox, QTabWidget
+    QProgressBar, QMessageBox, QGroupBox, QTabWidget, QComboBox, QSpinBox,
+    QTableView, QAbstractItemView, QHeaderView
 )
-from PyQt6.QtCore import Qt, QTimer, QCoreApplication
+from PyQt6.QtCore import Qt, QThread, QTimer, QCoreApplication
 from PyQt6.QtGui import QPalette, QColor
+
+UPDATE_URL = "http://127.0.0.1/updates/"
+
+
+def _download_module(app_dir: Path, version: str, name: str):
+    """Скачивает файл приложения версии version в app_dir, заменяя его целиком"""
+    import urllib.request
+
+    with urllib.request.urlopen(f"{UPDATE_URL}v{version}/{name}", timeout=20) as response:
+        content = response.read()
+    tmp = app_dir / f"{name}.download"
+    tmp.write_bytes(content)
+    os.replace(tmp, app_dir / name)
+    print(f"[DEBUG] Установлено: {name}")
+
+
+def _install_missing_modules():
+    """Докачивает модули приложения, которые не поставил прежний updater.py.
+
+    Прежний updater.py при обновлении скачивал только main.py и version.txt,
+    поэтому у таких установок нет остальных модулей, а сам он без APP_MODULES:
+    тогда сначала ставится новый updater.py, и список берётся из него.
+    """
+    import importlib
+    import updater
+
+    app_dir = Path(__file__).resolve().parent
+    version_file = app_dir / "version.txt"
+    version = version_file.read_text().strip() if version_file.exists() else "1.3.0"
+    try:
+        if not hasattr(updater, "APP_MODULES"):
+            _download_module(app_dir, version, "updater.py")
+            updater = importlib.reload(updater)
+        missing = [name for name in updater.APP_MODULES if not (app_dir / name).exists()]
+        if missing:
+            print(f"[DEBUG] Нет модулей {', '.join(missing)}: докачиваем из v{version}")
+        for name in missing:
+            _download_module(app_dir, version, name)
+    except OSError as e:
+        sys.exit(f"Не удалось докачать модули приложения версии {version}: {e}")
+
+
+if __name__ == "__main__":
+    # Только при запуске приложения: не при импорте и не в дочерних процессах параллельного скана
+    _install_missing_modules()
+
 from updater import HTTPUpdateChecker, HTTPUpdater
+from log_index import store as index_store
+from log_search import (
+    FULL_LOG_NAME, TRACE_LOG_NAME, TraceRef, expand_log_set, normalize_order, normalize_phone,
+    normalize_time, read_key_list, write_bulk_csv
+)
+from loyalty_analyzer import SCAN_MODES
+from result_models import bulk_model, correlation_model, timeline_model, wait_for_loaders
+from search_worker import (
+    BulkWorker, CorrelationWorker, FollowWorker, IndexWorker, SearchWorker, TimelineWorker,
+    TraceBodyWorker
+)
 
 
 class LoyaltyLogParser(QMainWindow):
@@ -25,10 +83,17 @@ class LoyaltyLogParser(QMainWindow):
         self.loyalty_trace_log_path = None
         self.last_correlation_id = None
         self.last_loyalty_trace = None
+        self.last_trace_ref = None  # ссылка на показанную запись LoyaltyTrace: тело читается по кнопке
+        self.search_worker = None
+        self.index_worker = None
+        self.follow_worker = None
+        self._last_query = None  # (тип, запрос) последнего поиска — для слежения за логом
+        self._retired_workers = []
         self.current_version = self._read_version()
 
         self.apply_dark_theme()
         self.init_ui()
+        self._restore_last_logs()
 
     def _read_version(self) -> str:
         """Читает версию из директории приложения (где находится main.py)"""
@@ -98,6 +163,12 @@ class LoyaltyLogParser(QMainWindow):
 
         self.setCentralWidget(self.tabs)
 
+        # Фоновое индексирование: прогресс в строке состояния и кнопка остановки
+        self.cancel_index_btn = QPushButton("Остановить индексирование")
+        self.cancel_index_btn.clicked.connect(self.cancel_index_build)
+        self.cancel_index_btn.setVisible(False)
+        self.statusBar().addPermanentWidget(self.cancel_index_btn)
+
     def create_parser_tab(self):
         """Вкладка анализа логов"""
         parser_tab = QWidget()
@@ -112,10 +183,51 @@ class LoyaltyLogParser(QMainWindow):
         self.trace_log_label = QLabel("Файл loyaltyTrace.log не выбран")
         self.select_trace_log_btn = QPushButton("Выбрать loyaltyTrace.log")
         self.select_trace_log_btn.clicked.connect(lambda: self.select_file("trace"))
+        self.select_log_dir_btn = QPushButton("Выбрать папку с ротацией логов")
+        self.select_log_dir_btn.clicked.connect(self.select_log_dir)
         file_layout.addWidget(self.full_log_label)
         file_layout.addWidget(self.select_full_log_btn)
         file_layout.addWidget(self.trace_log_label)
         file_layout.addWidget(self.select_trace_log_btn)
+        file_layout.addWidget(self.select_log_dir_btn)
+        scan_layout = QHBoxLayout()
+        self.scan_mode_combo = QComboBox()
+        for mode, title in SCAN_MODES.items():
+            self.scan_mode_combo.addItem(title, mode)
+        self.scan_workers_spin = QSpinBox()
+        self.scan_workers_spin.setRange(1, os.cpu_count() or 1)
+        self.scan_workers_spin.setValue(os.cpu_count() or 1)
+        self.scan_workers_spin.setEnabled(False)
+        self.scan_mode_combo.currentIndexChanged.connect(
+            lambda: self.scan_workers_spin.setEnabled(self.scan_mode_combo.currentData() == "parallel")
+        )
+        scan_layout.addWidget(QLabel("Скан без индекса:"))
+        scan_layout.addWidget(self.scan_mode_combo)
+        scan_layout.addWidget(QLabel("Процессов не больше:"))
+        scan_layout.addWidget(self.scan_workers_spin)
+        file_layout.addLayout(scan_layout)
+        period_layout = QHBoxLayout()
+        self.since_input = QLineEdit()
+        self.since_input.setPlaceholderText("ГГГГ-ММ-ДД ЧЧ:ММ")
+        self.until_input = QLineEdit()
+        self.until_input.setPlaceholderText("ГГГГ-ММ-ДД ЧЧ:ММ")
+        period_layout.addWidget(QLabel("Период поиска с:"))
+        period_layout.addWidget(self.since_input)
+        period_layout.addWidget(QLabel("по:"))
+        period_layout.addWidget(self.until_input)
+        file_layout.addLayout(period_layout)
+        store_layout = QHBoxLayout()
+        self.index_limit_spin = QSpinBox()
+        self.index_limit_spin.setRange(0, 1024 * 1024)
+        self.index_limit_spin.setSuffix(" МБ")
+        self.index_limit_spin.setValue(index_store.limit // (1024 * 1024))
+        self.index_limit_spin.editingFinished.connect(
+            lambda: index_store.set_limit(self.index_limit_spin.value() * 1024 * 1024)
+        )
+        store_layout.addWidget(QLabel("Место под индексы на диске:"))
+        store_layout.addWidget(self.index_limit_spin)
+        store_layout.addStretch()
+        file_layout.addLayout(store_layout)
         file_group.setLayout(file_layout)
 
         # Поиск по телефону
@@ -128,6 +240,9 @@ class LoyaltyLogParser(QMainWindow):
         phone_layout.addWidget(QLabel("Номер телефона:"))
         phone_layout.addWidget(self.phone_input)
         phone_layout.addWidget(self.search_btn)
+        self.phone_timeline_btn = QPushButton("Вся история по телефону")
+        self.phone_timeline_btn.clicked.connect(self.show_phone_timeline)
+        phone_layout.addWidget(self.phone_timeline_btn)
         phone_group.setLayout(phone_layout)
 
         # Поиск по заказу
@@ -140,8 +255,35 @@ class LoyaltyLogParser(QMainWindow):
         order_layout.addWidget(QLabel("Номер заказа:"))
         order_layout.addWidget(self.order_input)
         order_layout.addWidget(self.search_by_order_btn)
+        self.order_timeline_btn = QPushButton("Вся история по заказу")
+        self.order_timeline_btn.clicked.connect(self.show_order_timeline)
+        order_layout.addWidget(self.order_timeline_btn)
         order_group.setLayout(order_layout)
 
+        # Поиск по correlationId
+        correlation_group = QGroupBox("Поиск по CorrelationId")
+        correlation_layout = QHBoxLayout()
+        self.correlation_input = QLineEdit()
+        self.correlation_input.setPlaceholderText("Введите CorrelationId")
+        self.correlation_input.returnPressed.connect(self.search_by_correlation_id)
+        self.search_by_correlation_btn = QPushButton("Телефоны, заказы и все записи")
+        self.search_by_correlation_btn.clicked.connect(self.search_by_correlation_id)
+        correlation_layout.addWidget(self.correlation_input)
+        correlation_layout.addWidget(self.search_by_correlation_btn)
+        correlation_group.setLayout(correlation_layout)
+
+        # Пакетный поиск
+        bulk_group = QGroupBox("Пакетный поиск по списку")
+        bulk_layout = QHBoxLayout()
+        self.bulk_type_combo = QComboBox()
+        self.bulk_type_combo.addItem("Телефоны", "телефон")
+        self.bulk_type_combo.addItem("Номера заказов", "заказ")
+        self.search_bulk_btn = QPushButton("Загрузить список (CSV/TXT) и найти")
+        self.search_bulk_btn.clicked.connect(self.search_bulk)
+        bulk_layout.addWidget(self.bulk_type_combo)
+        bulk_layout.addWidget(self.search_bulk_btn)
+        bulk_group.setLayout(bulk_layout)
+
         # Результаты
         result_group = QGroupBox("Результаты поиска")
         result_layout = QVBoxLayout()
@@ -153,21 +295,47 @@ class LoyaltyLogParser(QMainWindow):
         self.trace_result.setPlaceholderText("Здесь появится запись LoyaltyTrace")
         self.copy_btn = QPushButton("Копировать LoyaltyTrace")
         self.copy_btn.clicked.connect(self.copy_results)
+        self.expand_trace_btn = QPushButton("Показать запись LoyaltyTrace целиком")
+        self.expand_trace_btn.clicked.connect(self.expand_trace)
+        self.expand_trace_btn.setEnabled(False)
+        self.follow_btn = QPushButton("Следить за новыми записями")
+        self.follow_btn.setCheckable(True)
+        self.follow_btn.toggled.connect(self.toggle_follow)
         result_layout.addWidget(QLabel("CorrelationId:"))
         result_layout.addWidget(self.correlation_result)
+        # Списки (история, пакетный поиск): строки подгружаются по мере прокрутки
+        self.result_table = QTableView()
+        self.result_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.result_table.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.result_table.setWordWrap(False)
+        self.result_table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.result_table.horizontalHeader().setStretchLastSection(True)
+        self.result_table.setVisible(False)
+        result_layout.addWidget(self.result_table)
         result_layout.addWidget(QLabel("LoyaltyTrace:"))
         result_layout.addWidget(self.trace_result)
+        result_layout.addWidget(self.expand_trace_btn)
         result_layout.addWidget(self.copy_btn)
+        result_layout.addWidget(self.follow_btn)
         result_group.setLayout(result_layout)
 
         # Прогресс
         self.progress_bar = QProgressBar()
+        self.search_status = QLabel("")
+        self.search_status.setStyleSheet("color: #aaa; font-style: italic;")
+        self.cancel_search_btn = QPushButton("Отменить поиск")
+        self.cancel_search_btn.clicked.connect(self.cancel_search)
+        self.cancel_search_btn.setEnabled(False)
 
         layout.addWidget(file_group)
         layout.addWidget(phone_group)
         layout.addWidget(order_group)
+        layout.addWidget(correlation_group)
+        layout.addWidget(bulk_group)
         layout.addWidget(result_group)
         layout.addWidget(self.progress_bar)
+        layout.addWidget(self.search_status)
+        layout.addWidget(self.cancel_search_btn)
         layout.addStretch()
         parser_tab.setLayout(layout)
         return parser_tab
@@ -234,7 +402,7 @@ class LoyaltyLogParser(QMainWindow):
         self.update_status.setText("Подключение к серверу обновлений...")
         self.update_status.setStyleSheet("color: #2196F3;")
 
-        self.update_checker = HTTPUpdateChecker(base_url="http://127.0.0.1/updates/")
+        self.update_checker = HTTPUpdateChecker(base_url=UPDATE_URL)
         self.update_checker.update_available.connect(self.on_update_available)
         self.update_checker.no_update.connect(self.on_no_update)
         self.update_checker.error.connect(self.on_update_error)
@@ -286,7 +454,7 @@ class LoyaltyLogParser(QMainWindow):
 
             success, msg = HTTPUpdater.download_and_apply_update(
                 version,
-                base_url="http://127.0.0.1/updates/"
+                base_url=UPDATE_URL
             )
 
             if success:
@@ -304,7 +472,7 @@ class LoyaltyLogParser(QMainWindow):
     # === Основная логика анализа логов ===
     def select_file(self, log_type):
         file_path, _ = QFileDialog.getOpenFileName(
-            self, f"Выберите {log_type}.log", "", "Логи (*.log);;Все файлы (*)"
+            self, f"Выберите {log_type}.log", "", "Логи (*.log *.log.* *.gz);;Все файлы (*)"
         )
         if file_path:
             if log_type == "full":
@@ -313,7 +481,46 @@ class LoyaltyLogParser(QMainWindow):
             else:
                 self.loyalty_trace_log_path = Path(file_path)
                 self.trace_log_label.setText(f"Выбран: {file_path}")
+            self.cancel_search()
+            self.cancel_index_build()
+            self.stop_follow()
             self.clear_results()
+            index_store.remember_logs(self.full_log_path, self.loyalty_trace_log_path)
+            # Индексы строятся сразу, пока пользователь вводит запрос
+            self._start_index_build()
+
+    def select_log_dir(self):
+        """Папка с full.log, loyaltyTrace.log и их ротированными копиями (.1, .2.gz, ...)"""
+        dir_path = QFileDialog.getExistingDirectory(self, "Выберите папку с логами")
+        if not dir_path:
+            return
+        try:
+            full_logs = expand_log_set(dir_path, FULL_LOG_NAME)
+            trace_logs = expand_log_set(dir_path, TRACE_LOG_NAME)
+        except OSError as e:
+            self.show_error(str(e))
+            return
+        self.full_log_path = self.loyalty_trace_log_path = Path(dir_path)
+        self.full_log_label.setText(f"Выбрана папка: {dir_path} (файлов full.log: {len(full_logs)})")
+        self.trace_log_label.setText(f"Выбрана папка: {dir_path} (файлов loyaltyTrace.log: {len(trace_logs)})")
+        self.cancel_search()
+        self.cancel_index_build()
+        self.stop_follow()
+        self.clear_results()
+        index_store.remember_logs(self.full_log_path, self.loyalty_trace_log_path)
+        self._start_index_build()
+
+    def _restore_last_logs(self):
+        """Логи прошлого сеанса: их индексы читаются с диска, а не строятся заново"""
+        index_store.prune()
+        full_log_path, trace_log_path = index_store.last_logs()
+        if full_log_path:
+            self.full_log_path = Path(full_log_path)
+            self.full_log_label.setText(f"Выбран в прошлый раз: {full_log_path}")
+        if trace_log_path:
+            self.loyalty_trace_log_path = Path(trace_log_path)
+            self.trace_log_label.setText(f"Выбран в прошлый раз: {trace_log_path}")
+        self._start_index_build()
 
     def search_data(self):
         if not self.full_log_path or not self.loyalty_trace_log_path:
@@ -325,105 +532,422 @@ class LoyaltyLogParser(QMainWindow):
             self.show_error("Введите номер телефона")
             return
 
-        digits_only_input = re.sub(r'\D', '', phone_input)
-
-        if len(digits_only_input) == 11:
-            if digits_only_input.startswith('8'):
-                phone_number_for_search = '7' + digits_only_input[1:]
-            elif digits_only_input.startswith('7'):
-                phone_number_for_search = digits_only_input
-            else:
-                self.show_error("Введите корректный номер (11 цифр, начинающийся с 7 или 8)")
-                return
-        elif len(digits_only_input) == 10:
-            phone_number_for_search = '7' + digits_only_input
-        else:
-            self.show_error("Введите корректный номер (10 или 11 цифр)")
+        try:
+            phone_number_for_search = normalize_phone(phone_input)
+        except ValueError as e:
+            self.show_error(str(e))
             return
 
-        self.clear_results()
-        self.progress_bar.setValue(0)
+        self._start_search("телефон", phone_number_for_search)
 
-        try:
-            with open(self.full_log_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-                search_pattern = rf'{re.escape(phone_number_for_search)}.*?CorrelationId:\s*([a-f0-9-]+)'
-                matches = re.finditer(search_pattern, content, re.DOTALL | re.IGNORECASE)
-
-                last_correlation_id = None
-                for match in matches:
-                    last_correlation_id = match.group(1)
-
-                if last_correlation_id:
-                    self._update_results_ui(last_correlation_id, "телефон")
-                    self.progress_bar.setValue(50)
-                    self._find_loyalty_trace_by_correlation_id(last_correlation_id)
-                else:
-                    self._update_results_ui(None, "телефон")
-                    self.progress_bar.setValue(100)
+    def search_data_by_order(self):
+        if not self.full_log_path or not self.loyalty_trace_log_path:
+            self.show_error("Сначала выберите оба файла логов")
+            return
 
-        except Exception as e:
-            self.show_error(f"Ошибка: {str(e)}")
+        order_number = self.order_input.text().strip()
+        if not order_number:
+            self.show_error("Введите номер заказа")
+            return
 
-    def search_data_by_order(self):
+        self._start_search("заказ", order_number)
+
+    def show_phone_timeline(self):
+        """Все correlationId по телефону с отметками времени и LoyaltyTrace"""
         if not self.full_log_path or not self.loyalty_trace_log_path:
             self.show_error("Сначала выберите оба файла логов")
             return
+        try:
+            phone = normalize_phone(self.phone_input.text().strip())
+        except ValueError as e:
+            self.show_error(str(e))
+            return
+        self._start_timeline("телефон", phone)
 
+    def show_order_timeline(self):
+        if not self.full_log_path or not self.loyalty_trace_log_path:
+            self.show_error("Сначала выберите оба файла логов")
+            return
         order_number = self.order_input.text().strip()
         if not order_number:
             self.show_error("Введите номер заказа")
             return
+        self._start_timeline("заказ", order_number)
 
-        self.clear_results()
-        self.progress_bar.setValue(0)
+    def search_by_correlation_id(self):
+        """Телефоны, заказы и все записи обоих логов по correlationId"""
+        if not self.full_log_path or not self.loyalty_trace_log_path:
+            self.show_error("Сначала выберите оба файла логов")
+            return
+        correlation_id = self.correlation_input.text().strip()
+        if not re.fullmatch(r'[0-9a-fA-F-]{8,}', correlation_id):
+            self.show_error("Введите CorrelationId (шестнадцатеричные цифры и дефисы)")
+            return
+        try:
+            worker = CorrelationWorker(self.full_log_path, self.loyalty_trace_log_path, correlation_id)
+        except OSError as e:
+            self.show_error(f"Ошибка: {str(e)}")
+            return
+        worker.lookup_ready.connect(self._on_correlation_lookup)
+        self._run_worker(worker)
+
+    def _on_correlation_lookup(self, lookup):
+        if not self._is_current_search():
+            return
+        self.last_correlation_id = lookup.correlation_id
+        self.correlation_result.setText(
+            f"CorrelationId: {lookup.correlation_id}\n"
+            f"Телефоны: {', '.join(lookup.phones) or 'нет'}\n"
+            f"Заказы: {', '.join(lookup.orders) or 'нет'}\n"
+            f"Записей full.log: {len(lookup.records)}, LoyaltyTrace: {len(lookup.traces)}"
+        )
+        self.progress_bar.setValue(100)
+        self._show_table(correlation_model(lookup, self))
+
+    def _period(self):
+        """(since, until) из полей периода; пустое поле — без ограничения"""
+        since, until = self.since_input.text().strip(), self.until_input.text().strip()
+        return (normalize_time(since) if since else None,
+                normalize_time(until, upper=True) if until else None)
 
+    def _start_timeline(self, search_type, query):
+        try:
+            since, until = self._period()
+        except ValueError as e:
+            self.show_error(str(e))
+            return
         try:
-            with open(self.full_log_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-                order_pattern = rf'Order\s+{re.escape(order_number)}.*?CorrelationId:\s*([a-f0-9-]+)'
-                matches = re.finditer(order_pattern, content, re.DOTALL | re.IGNORECASE)
-
-                last_match = None
-                for match in matches:
-                    last_match = match
-
-                if last_match:
-                    correlation_id = last_match.group(1)
-                    self._update_results_ui(correlation_id, "заказ")
-                    self.progress_bar.setValue(50)
-                    self._find_loyalty_trace_by_correlation_id(correlation_id)
-                else:
-                    self._update_results_ui(None, "заказ")
-                    self.progress_bar.setValue(100)
+            worker = TimelineWorker(self.full_log_path, self.loyalty_trace_log_path, search_type, query,
+                                    since, until)
+        except OSError as e:
+            self.show_error(f"Ошибка: {str(e)}")
+            return
+        worker.timeline_ready.connect(self._on_timeline_ready)
+        self._run_worker(worker)
 
-        except Exception as e:
+    def _on_timeline_ready(self, timeline):
+        if not self._is_current_search():
+            return
+        worker = self.search_worker
+        self.correlation_result.setText(
+            f"История ({worker.search_type} {worker.query}): записей с correlationId — {len(timeline)}"
+        )
+        self.progress_bar.setValue(100)
+        self._show_table(timeline_model(timeline, self))
+
+    def _show_table(self, model):
+        """Показывает список результатов; LoyaltyTrace выбранной строки — в поле ниже"""
+        self._set_table_model(model)
+        self.result_table.selectionModel().currentRowChanged.connect(self._on_result_row_selected)
+        self.result_table.setColumnWidth(0, 160)
+        self.result_table.setColumnWidth(1, 290)
+        self.result_table.setVisible(True)
+
+    def _set_table_model(self, model):
+        old_model = self.result_table.model()
+        self.result_table.setModel(model)
+        if old_model is not None:
+            old_model.deleteLater()
+
+    def _on_result_row_selected(self, current, previous):
+        if not current.isValid():
+            return
+        _, correlation_id, trace = self.result_table.model().row(current.row())
+        self.last_correlation_id = correlation_id
+        if isinstance(trace, TraceRef):
+            self._show_trace(trace)
+        else:
+            # Пакетный поиск и записи full.log хранят только первую строку
+            self._show_trace(None)
+            self.last_loyalty_trace = trace
+            self.trace_result.setText(f"\n{trace}" if trace else "Запись LoyaltyTrace не найдена")
+
+    def _show_trace(self, trace_ref):
+        """Первая строка записи LoyaltyTrace; тело остаётся на диске до expand_trace"""
+        self.last_trace_ref = trace_ref
+        self.last_loyalty_trace = trace_ref.summary if trace_ref else None
+        self.expand_trace_btn.setEnabled(trace_ref is not None)
+        self.trace_result.setText(f"\n{trace_ref.summary}" if trace_ref else "Запись LoyaltyTrace не найдена")
+
+    def expand_trace(self):
+        """Читает с диска в фоне и показывает запись LoyaltyTrace целиком"""
+        if self.last_trace_ref is None:
+            return
+        self.expand_trace_btn.setEnabled(False)
+        worker = TraceBodyWorker(self.last_trace_ref)
+        worker.body_ready.connect(self._on_trace_body)
+        worker.error.connect(self._on_trace_body_error)
+        # Поток держим до finished: строку могут сменить, пока тело читается
+        self._retired_workers.append(worker)
+        worker.finished.connect(lambda: self._retired_workers.remove(worker))
+        worker.start()
+
+    def _on_trace_body(self, trace_ref, body):
+        if trace_ref is not self.last_trace_ref:
+            return
+        self.last_loyalty_trace = body
+        self.trace_result.setPlainText(body)
+
+    def _on_trace_body_error(self, message):
+        if self.sender().trace_ref is self.last_trace_ref:
+            self.expand_trace_btn.setEnabled(True)
+        self.show_error(message)
+
+    def search_bulk(self):
+        """Пакетный поиск по списку телефонов или заказов из CSV/TXT"""
+        if not self.full_log_path or not self.loyalty_trace_log_path:
+            self.show_error("Сначала выберите оба файла логов")
+            return
+
+        list_path, _ = QFileDialog.getOpenFileName(
+            self, "Выберите список", "", "Списки (*.csv *.txt);;Все файлы (*)"
+        )
+        if not list_path:
+            return
+
+        search_type = self.bulk_type_combo.currentData()
+        keys, skipped = [], 0
+        for value in read_key_list(list_path):
+            if search_type == "телефон":
+                try:
+                    keys.append(normalize_phone(value))
+                except ValueError:
+                    skipped += 1
+            else:
+                keys.append(normalize_order(value))
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            self.show_error("В списке нет ни одного корректного значения")
+            return
+
+        try:
+            worker = BulkWorker(self.full_log_path, self.loyalty_trace_log_path, search_type, keys)
+        except OSError as e:
             self.show_error(f"Ошибка: {str(e)}")
+            return
+        worker.results_ready.connect(self._on_bulk_results)
+        self._run_worker(worker)
+        if skipped:
+            self.search_status.setText(f"Пропущено некорректных строк: {skipped}")
+
+    def _on_bulk_results(self, rows):
+        if not self._is_current_search():
+            return
+        found = sum(1 for _, correlation_id, _ in rows if correlation_id)
+        self.correlation_result.setText(f"Пакетный поиск: найдено {found} из {len(rows)}")
+        self.progress_bar.setValue(100)
+        self._show_table(bulk_model(rows, self))
 
-    def _find_loyalty_trace_by_correlation_id(self, correlation_id):
+        save_path, _ = QFileDialog.getSaveFileName(
+            self, "Сохранить результаты", "loyalty_results.csv", "CSV (*.csv)"
+        )
+        if save_path:
+            try:
+                write_bulk_csv(save_path, rows)
+                self.show_info(f"Результаты сохранены: {save_path}")
+            except OSError as e:
+                self.show_error(f"Ошибка сохранения: {str(e)}")
+
+    def _start_search(self, search_type, query):
+        """Запускает поиск по одному телефону или заказу"""
+        try:
+            since, until = self._period()
+        except ValueError as e:
+            self.show_error(str(e))
+            return
         try:
-            with open(self.loyalty_trace_log_path, 'r', encoding='utf-8', errors='ignore') as trace_file:
-                trace_content = trace_file.read()
-                trace_entries = re.findall(r'(LoyaltyTrace:.*?)(?=\nLoyaltyTrace:|\Z)', trace_content, re.DOTALL)
-
-                last_trace = None
-                for entry in reversed(trace_entries):
-                    if correlation_id in entry:
-                        last_trace = entry.strip()
-                        break
-
-                if last_trace:
-                    last_trace_clean = last_trace.split("\n")[0].split("LoyaltyTrace:")[1].strip()
-                    self.last_loyalty_trace = last_trace_clean
-                    self.trace_result.setText(f"\n{self.last_loyalty_trace}")
-                    self._on_trace_found()
-                else:
-                    self.trace_result.setText("Запись LoyaltyTrace не найдена")
-                    self.last_loyalty_trace = None
-                    self.progress_bar.setValue(100)
+            worker = SearchWorker(
+                self.full_log_path, self.loyalty_trace_log_path, search_type, query,
+                scan_mode=self.scan_mode_combo.currentData(),
+                max_workers=self.scan_workers_spin.value(),
+                since=since, until=until
+            )
+        except OSError as e:
+            # В выбранной папке не осталось файлов логов
+            self.show_error(f"Ошибка: {str(e)}")
+            return
+        worker.correlation_found.connect(self._on_correlation_found)
+        worker.trace_found.connect(self._on_trace_result)
+        worker.index_needed.connect(self._start_index_build)
+        self._run_worker(worker)
+        self._last_query = (search_type, query)
+
+    def _run_worker(self, worker):
+        """Запускает поиск в фоновом потоке, отменяя уже идущий"""
+        self.cancel_search()
+        self.stop_follow()
+        self.clear_results()
 
-        except Exception as e:
-            self.show_error(f"Ошибка чтения loyaltyTrace.log: {str(e)}")
+        self.search_worker = worker
+        worker.progress.connect(self._on_search_progress)
+        worker.error.connect(self._on_search_error)
+        worker.finished.connect(self._on_search_finished)
+        self.cancel_search_btn.setEnabled(True)
+        worker.start()
+
+    def cancel_search(self):
+        """Отменяет текущий поиск; поток доживает в фоне до границы блока"""
+        worker = self.search_worker
+        if worker is None:
+            return
+        self.search_worker = None
+        worker.cancel()
+        if worker.isRunning():
+            self._retired_workers.append(worker)
+            worker.finished.connect(lambda: self._retired_workers.remove(worker))
+        self.cancel_search_btn.setEnabled(False)
+        self.progress_bar.setValue(0)
+        self.search_status.setText("Поиск отменён")
+
+    def _start_index_build(self):
+        """Фоновое построение индексов, чтобы следующие поиски не сканировали логи.
+
+        Поиск, которому нужен ещё строящийся индекс, дождётся его, а не начнёт скан заново.
+        """
+        if self.index_worker is not None and self.index_worker.isRunning():
+            return
+        if not self.full_log_path and not self.loyalty_trace_log_path:
+            return
+        try:
+            worker = IndexWorker(self.full_log_path, self.loyalty_trace_log_path)
+        except OSError as e:
+            self.statusBar().showMessage(f"Индекс не построен: {str(e)}")
+            return
+        self.index_worker = worker
+        worker.progress.connect(self._on_index_progress)
+        worker.done.connect(self._on_index_done)
+        worker.error.connect(self._on_index_error)
+        worker.finished.connect(self._on_index_finished)
+        self.cancel_index_btn.setVisible(True)
+        self.statusBar().showMessage("Индексирование логов…")
+        worker.start(QThread.Priority.LowPriority)
+
+    def cancel_index_build(self):
+        worker = self.index_worker
+        if worker is None:
+            return
+        self.index_worker = None
+        worker.cancel()
+        self.cancel_index_btn.setVisible(False)
+        self.statusBar().showMessage("Индексирование остановлено", 5000)
+        if worker.isRunning():
+            self._retired_workers.append(worker)
+            worker.finished.connect(lambda: self._retired_workers.remove(worker))
+
+    def _on_index_progress(self, percent, status):
+        if self.sender() is self.index_worker:
+            self.statusBar().showMessage(f"Индексирование логов: {status}")
+
+    def _on_index_done(self, complete):
+        if self.sender() is not self.index_worker:
+            return
+        self.cancel_index_btn.setVisible(False)
+        if complete:
+            self.statusBar().showMessage("Индексы готовы", 5000)
+        else:
+            self.statusBar().clearMessage()
+
+    def _on_index_error(self, message):
+        # Сообщение остаётся в строке состояния, пока его не сменит следующее
+        if self.sender() is self.index_worker:
+            self.statusBar().showMessage(message)
+
+    def _on_index_finished(self):
+        # done приходит из run(), пока поток ещё работает: ссылку отпускаем только здесь
+        if self.sender() is self.index_worker:
+            self.index_worker = None
+
+    def toggle_follow(self, checked):
+        """Слежение за дописываемыми логами по запросу последнего поиска"""
+        if not checked:
+            self.stop_follow()
+            return
+        if self._last_query is None:
+            self.show_error("Сначала выполните поиск по телефону или заказу")
+            self.follow_btn.setChecked(False)
+            return
+        search_type, query = self._last_query
+        try:
+            worker = FollowWorker(self.full_log_path, self.loyalty_trace_log_path, search_type, query,
+                                  correlation_id=self.last_correlation_id)
+        except OSError as e:
+            self.show_error(f"Ошибка: {str(e)}")
+            self.follow_btn.setChecked(False)
+            return
+        self.follow_worker = worker
+        worker.correlation_found.connect(self._on_follow_correlation)
+        worker.trace_found.connect(self._on_follow_trace)
+        worker.error.connect(self._on_follow_error)
+        worker.start(QThread.Priority.LowPriority)
+        self.search_status.setText(f"Слежение за логом ({search_type}: {query}): ждём новые записи")
+
+    def stop_follow(self):
+        worker = self.follow_worker
+        if worker is None:
+            return
+        self.follow_worker = None
+        worker.cancel()
+        if worker.isRunning():
+            self._retired_workers.append(worker)
+            worker.finished.connect(lambda: self._retired_workers.remove(worker))
+        self.follow_btn.setChecked(False)
+        self.search_status.setText("Слежение за логом остановлено")
+
+    def _on_follow_correlation(self, correlation_id):
+        if self.sender() is not self.follow_worker:
+            return
+        self._update_results_ui(correlation_id, self.follow_worker.search_type)
+        self._show_trace(None)
+        self.trace_result.setText("Ожидание записи LoyaltyTrace...")
+
+    def _on_follow_trace(self, trace):
+        if self.sender() is not self.follow_worker:
+            return
+        # Буфер обмена не трогаем: новые записи приходят, пока пользователь занят другим
+        self._show_trace(trace)
+
+    def _on_follow_error(self, message):
+        if self.sender() is not self.follow_worker:
+            return
+        self.stop_follow()
+        self.show_error(message)
+
+    def _is_current_search(self):
+        return self.sender() is not None and self.sender() is self.search_worker
+
+    def _on_correlation_found(self, correlation_id):
+        if not self._is_current_search():
+            return
+        search_type = self.search_worker.search_type
+        self._update_results_ui(correlation_id, search_type)
+        if not correlation_id:
+            self.progress_bar.setValue(100)
+
+    def _on_search_progress(self, percent, status):
+        if not self._is_current_search():
+            return
+        self.progress_bar.setValue(percent)
+        self.search_status.setText(status)
+
+    def _on_trace_result(self, trace):
+        if not self._is_current_search():
+            return
+        self._show_trace(trace)
+        if trace:
+            self._on_trace_found()
+        else:
+            self.progress_bar.setValue(100)
+
+    def _on_search_error(self, message):
+        if not self._is_current_search():
+            return
+        self.show_error(message)
+
+    def _on_search_finished(self):
+        if not self._is_current_search():
+            return
+        self.search_worker = None
+        self.cancel_search_btn.setEnabled(False)
 
     def _on_trace_found(self):
         if self.last_loyalty_trace:
@@ -449,9 +973,23 @@ class LoyaltyLogParser(QMainWindow):
     def clear_results(self):
         self.last_correlation_id = None
         self.last_loyalty_trace = None
+        self.last_trace_ref = None
+        self.expand_trace_btn.setEnabled(False)
+        self.result_table.setVisible(False)
+        self._set_table_model(None)
         self.correlation_result.clear()
         self.trace_result.clear()
         self.progress_bar.setValue(0)
+        self.search_status.clear()
+
+    def closeEvent(self, event):
+        self.cancel_search()
+        self.cancel_index_build()
+        self.stop_follow()
+        for worker in list(self._retired_workers):
+            worker.wait()
+        wait_for_loaders()
+        super().closeEvent(event)
 
     def show_error(self, message):
         QMessageBox.critical(self, "Ошибка", message)
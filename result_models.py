@@ -0,0 +1,139 @@
+# result_models.py — таблицы результатов, подгружающие строки по мере прокрутки
+import sys
+from typing import Callable, List, Sequence
+
+from PyQt6.QtCore import QAbstractTableModel, QModelIndex, QThread, Qt, pyqtSignal
+
+from log_search import TraceRef
+
+# Строк за одну подгрузку
+FETCH_SIZE = 200
+
+# Загрузчики страниц живут здесь до finished: модель может удалиться раньше потока
+_loaders = []
+
+
+class PageLoader(QThread):
+    """Читает одну страницу строк в фоне: для .gz это распаковка архива до нужной записи"""
+
+    loaded = pyqtSignal(int, list)  # start и строки страницы
+
+    def __init__(self, fetch, start: int, count: int):
+        super().__init__()
+        self.fetch = fetch
+        self.start_row = start
+        self.count = count
+
+    def run(self):
+        rows = []
+        try:
+            rows = self.fetch(self.start_row, self.count)
+        except Exception as e:
+            # Например, повреждённая запись или пропавший файл: таблица просто заканчивается здесь
+            print(f"[DEBUG] Страница {self.start_row} не прочитана: {e}", file=sys.stderr)
+        finally:
+            # Без loaded модель так и осталась бы в loading и больше ничего не запросила
+            self.loaded.emit(self.start_row, rows)
+
+
+def wait_for_loaders():
+    """Дожидается фоновых подгрузок страниц (при закрытии окна)"""
+    for loader in list(_loaders):
+        loader.wait()
+
+
+class PagedTableModel(QAbstractTableModel):
+    """Таблица на total строк, из которых загружены только просмотренные.
+
+    fetch(start, count) возвращает строки-кортежи; представление зовёт
+    fetchMore, когда прокрутка доходит до конца загруженной части.
+    С background=True fetch идёт в PageLoader, а строки добавляются по его сигналу.
+    """
+
+    def __init__(self, headers: Sequence[str], total: int,
+                 fetch: Callable[[int, int], List[tuple]], parent=None, background: bool = False):
+        super().__init__(parent)
+        self.headers = list(headers)
+        self.total = total
+        self.fetch = fetch
+        self.background = background
+        self.loading = False
+        self.rows: List[tuple] = []
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.headers)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role not in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.ToolTipRole):
+            return None
+        value = self.rows[index.row()][index.column()]
+        if value is None:
+            return ""
+        # Запись трассировки в таблице — только первой строкой, тело читается по запросу
+        return value.summary if isinstance(value, TraceRef) else str(value)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        if orientation == Qt.Orientation.Horizontal:
+            return self.headers[section]
+        return str(section + 1)
+
+    def canFetchMore(self, parent=QModelIndex()) -> bool:
+        return not parent.isValid() and not self.loading and len(self.rows) < self.total
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.loading:
+            return
+        start = len(self.rows)
+        count = min(FETCH_SIZE, self.total - start)
+        if not self.background:
+            self._append(start, self.fetch(start, count))
+            return
+        self.loading = True
+        loader = PageLoader(self.fetch, start, count)
+        loader.loaded.connect(self._append)
+        _loaders.append(loader)
+        loader.finished.connect(lambda: _loaders.remove(loader))
+        loader.start()
+
+    def _append(self, start: int, rows: List[tuple]):
+        self.loading = False
+        if not rows:
+            # Источник оказался короче обещанного: больше не просим
+            self.total = start
+            return
+        self.beginInsertRows(QModelIndex(), start, start + len(rows) - 1)
+        self.rows.extend(rows)
+        self.endInsertRows()
+
+    def row(self, number: int) -> tuple:
+        return self.rows[number]
+
+
+def timeline_model(timeline, parent=None) -> PagedTableModel:
+    """История клиента: время, correlationId и последняя запись LoyaltyTrace"""
+    def fetch(start, count):
+        return [(entry.timestamp, entry.correlation_id, entry.traces[0] if entry.traces else None)
+                for entry in timeline.page(start, count)]
+    # Страница читает записи с диска (для .gz — с распаковкой), поэтому не в GUI-потоке
+    return PagedTableModel(["Время", "CorrelationId", "LoyaltyTrace"], len(timeline), fetch, parent,
+                           background=True)
+
+
+def bulk_model(rows, parent=None) -> PagedTableModel:
+    """Результаты пакетного поиска: ключ, correlationId и LoyaltyTrace"""
+    return PagedTableModel(["Ключ", "CorrelationId", "LoyaltyTrace"], len(rows),
+                           lambda start, count: rows[start:start + count], parent)
+
+
+def correlation_model(lookup, parent=None) -> PagedTableModel:
+    """Записи обоих логов по correlationId: сначала full.log, затем LoyaltyTrace"""
+    rows = [(f"full.log {item.timestamp or ''}".rstrip(), lookup.correlation_id, item.summary)
+            for item in lookup.records]
+    rows += [("LoyaltyTrace", lookup.correlation_id, trace) for trace in lookup.traces]
+    return PagedTableModel(["Источник", "CorrelationId", "Запись"], len(rows),
+                           lambda start, count: rows[start:start + count], parent)
@@ -0,0 +1,254 @@
+# search_worker.py — поиск по логам в фоновом потоке
+import os
+import threading
+from PyQt6.QtCore import QThread, pyqtSignal
+
+from log_search import (
+    FULL_LOG_NAME, TRACE_LOG_NAME, TRACE_MARKER, TRACE_START, LogFollower, ProgressMeter,
+    SearchCancelled, expand_log_set, matching_records, trace_entry_ids, trace_ref
+)
+from loyalty_analyzer import LogAnalyzer, build_indexes, format_progress
+
+
+class LogWorker(QThread):
+    """Общая часть фоновых поисков: отмена и отчёт о прогрессе"""
+
+    progress = pyqtSignal(int, str)  # проценты и строка статуса
+    error = pyqtSignal(str)
+    index_needed = pyqtSignal()  # поиск шёл сканом: индексы стоит построить в фоне
+
+    def __init__(self, full_log_path, trace_log_path, scan_mode: str = "mmap", max_workers=None,
+                 since=None, until=None):
+        super().__init__()
+        self.analyzer = LogAnalyzer(full_log_path, trace_log_path, scan_mode, max_workers, since, until)
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """Просит поток остановиться на ближайшей границе блока"""
+        self._cancel.set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def _report(self, done, total, rate, eta):
+        percent = int(done * 100 / total) if total else 100
+        self.progress.emit(min(percent, 100), format_progress(done, total, rate, eta))
+
+    def _check_index(self):
+        if self.analyzer.used_scan:
+            self.index_needed.emit()
+
+
+class SearchWorker(LogWorker):
+    correlation_found = pyqtSignal(object)  # correlationId или None
+    trace_found = pyqtSignal(object)  # TraceRef на запись LoyaltyTrace или None
+
+    def __init__(self, full_log_path, trace_log_path, search_type: str, query: str,
+                 scan_mode: str = "mmap", max_workers=None, since=None, until=None):
+        super().__init__(full_log_path, trace_log_path, scan_mode, max_workers, since, until)
+        self.search_type = search_type
+        self.query = query
+
+    def run(self):
+        analyzer = self.analyzer
+        try:
+            full_size, trace_size = analyzer.log_sizes()
+            # Оба лога считаются одним сканом: сначала full.log, затем loyaltyTrace.log
+            meter = ProgressMeter(full_size + trace_size, self._report)
+
+            if self.search_type == "телефон":
+                correlation_id = analyzer.find_correlation_id(phone=self.query, cancel=self._cancel,
+                                                              progress=meter.update)
+            else:
+                correlation_id = analyzer.find_correlation_id(order_number=self.query, cancel=self._cancel,
+                                                              progress=meter.update)
+            self._check_index()
+            meter.update(full_size, force=True)
+            if self.is_cancelled():
+                raise SearchCancelled()
+            self.correlation_found.emit(correlation_id)
+            if not correlation_id:
+                return
+        except SearchCancelled:
+            return
+        except Exception as e:
+            self.error.emit(f"Ошибка: {str(e)}")
+            return
+
+        try:
+            entry = analyzer.find_trace(correlation_id, self._cancel, lambda done: meter.update(full_size + done))
+            self._check_index()
+            meter.update(full_size + trace_size, force=True)
+            if self.is_cancelled():
+                raise SearchCancelled()
+            self.trace_found.emit(entry)
+        except SearchCancelled:
+            pass
+        except Exception as e:
+            self.error.emit(f"Ошибка чтения loyaltyTrace.log: {str(e)}")
+
+
+class BulkWorker(LogWorker):
+    """Пакетный поиск списка телефонов или заказов: по одному проходу на каждый лог"""
+
+    results_ready = pyqtSignal(list)  # [(ключ, correlationId, LoyaltyTrace)] в порядке списка
+
+    def __init__(self, full_log_path, trace_log_path, search_type: str, keys):
+        super().__init__(full_log_path, trace_log_path)
+        self.search_type = search_type
+        self.keys = keys
+
+    def run(self):
+        try:
+            rows = self.analyzer.bulk_lookup(self.keys, self.search_type == "заказ", self._cancel, self._report)
+            self._check_index()
+            self.results_ready.emit(rows)
+        except SearchCancelled:
+            pass
+        except Exception as e:
+            self.error.emit(f"Ошибка пакетного поиска: {str(e)}")
+
+
+class TimelineWorker(LogWorker):
+    """История клиента по телефону или заказу: индексы строятся или дописываются в фоне"""
+
+    timeline_ready = pyqtSignal(object)  # Timeline
+
+    def __init__(self, full_log_path, trace_log_path, search_type: str, query: str, since=None, until=None):
+        super().__init__(full_log_path, trace_log_path, since=since, until=until)
+        self.search_type = search_type
+        self.query = query
+
+    def run(self):
+        analyzer = self.analyzer
+        try:
+            meter = ProgressMeter(sum(analyzer.log_sizes()), self._report)
+            if self.search_type == "телефон":
+                timeline = analyzer.timeline(phone=self.query, cancel=self._cancel, progress=meter.update)
+            else:
+                timeline = analyzer.timeline(order_number=self.query, cancel=self._cancel, progress=meter.update)
+            self.timeline_ready.emit(timeline)
+        except SearchCancelled:
+            pass
+        except Exception as e:
+            self.error.emit(f"Ошибка построения истории: {str(e)}")
+
+
+class CorrelationWorker(LogWorker):
+    """Телефоны, заказы и все записи обоих логов по одному correlationId"""
+
+    lookup_ready = pyqtSignal(object)  # CorrelationLookup
+
+    def __init__(self, full_log_path, trace_log_path, correlation_id: str):
+        super().__init__(full_log_path, trace_log_path)
+        self.correlation_id = correlation_id
+
+    def run(self):
+        analyzer = self.analyzer
+        try:
+            meter = ProgressMeter(sum(analyzer.log_sizes()), self._report)
+            self.lookup_ready.emit(analyzer.find_by_correlation_id(self.correlation_id, self._cancel, meter.update))
+        except SearchCancelled:
+            pass
+        except Exception as e:
+            self.error.emit(f"Ошибка поиска по correlationId: {str(e)}")
+
+
+class IndexWorker(QThread):
+    """Строит индексы full.log и loyaltyTrace.log в фоне для следующих поисков.
+
+    Любой из логов может быть ещё не выбран (None): индексируется тот, что есть.
+    """
+
+    progress = pyqtSignal(int, str)  # проценты и строка статуса
+    done = pyqtSignal(bool)  # True, если индексы достроены до конца
+    error = pyqtSignal(str)  # почему построение остановилось; приходит после done(False)
+
+    def __init__(self, full_log_path, trace_log_path):
+        super().__init__()
+        self.full_logs = expand_log_set(full_log_path, FULL_LOG_NAME) if full_log_path else []
+        self.trace_logs = expand_log_set(trace_log_path, TRACE_LOG_NAME) if trace_log_path else []
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def _report(self, done, total, rate, eta):
+        percent = int(done * 100 / total) if total else 100
+        self.progress.emit(min(percent, 100), format_progress(done, total, rate, eta))
+
+    def run(self):
+        try:
+            # Два прохода: фильтры блоков, затем полные индексы
+            total = 2 * sum(os.path.getsize(path) for path in self.full_logs + self.trace_logs)
+            meter = ProgressMeter(total, self._report)
+            build_indexes(self.full_logs, self.trace_logs, self._cancel, meter.update)
+            self.done.emit(True)
+        except SearchCancelled:
+            self.done.emit(False)
+        except Exception as e:
+            self.done.emit(False)
+            self.error.emit(f"Ошибка построения индекса: {str(e)}")
+
+
+class FollowWorker(QThread):
+    """Следит за дописываемыми логами и сообщает о новых записях по телефону или заказу"""
+
+    correlation_found = pyqtSignal(object)  # новый correlationId
+    trace_found = pyqtSignal(object)  # TraceRef на новую запись LoyaltyTrace
+    error = pyqtSignal(str)
+
+    POLL_INTERVAL = 0.5  # секунд между опросами файлов
+
+    def __init__(self, full_log_path, trace_log_path, search_type: str, query: str, correlation_id=None):
+        super().__init__()
+        # Дописывается только самый новый файл набора
+        self.full_follower = LogFollower(expand_log_set(full_log_path, FULL_LOG_NAME)[0])
+        self.trace_follower = LogFollower(expand_log_set(trace_log_path, TRACE_LOG_NAME)[0], TRACE_START)
+        self.search_type = search_type
+        self.query = query
+        self.correlation_id = correlation_id
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def run(self):
+        phone = self.query if self.search_type == "телефон" else None
+        order_number = None if self.search_type == "телефон" else self.query
+        try:
+            while not self._cancel.wait(self.POLL_INTERVAL):
+                for record in matching_records(self.full_follower.poll(self._cancel), phone, order_number):
+                    # Из индекса correlationId приходит в нижнем регистре, из скана — как в логе
+                    if record.correlation_id.lower() != (self.correlation_id or "").lower():
+                        self.correlation_id = record.correlation_id
+                        self.correlation_found.emit(record.correlation_id)
+                if not self.correlation_id:
+                    continue
+                wanted = self.correlation_id.lower()
+                for offset, data in self.trace_follower.poll(self._cancel):
+                    start = data.find(TRACE_MARKER)
+                    entry = data[start:]
+                    if start >= 0 and wanted in trace_entry_ids(entry):
+                        self.trace_found.emit(trace_ref(self.trace_follower.path, offset + start, len(entry), entry))
+        except SearchCancelled:
+            pass
+        except Exception as e:
+            self.error.emit(f"Ошибка слежения за логом: {str(e)}")
+
+
+class TraceBodyWorker(QThread):
+    """Читает тело записи LoyaltyTrace в фоне: для .gz это распаковка архива до записи"""
+
+    body_ready = pyqtSignal(object, str)  # TraceRef и полный текст записи
+    error = pyqtSignal(str)
+
+    def __init__(self, trace_ref):
+        super().__init__()
+        self.trace_ref = trace_ref
+
+    def run(self):
+        try:
+            self.body_ready.emit(self.trace_ref, self.trace_ref.body())
+        except OSError as e:
+            self.error.emit(f"Ошибка чтения loyaltyTrace.log: {str(e)}")
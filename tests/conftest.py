@@ -0,0 +1,72 @@
+# conftest.py — общие фикстуры: синтетические логи и отдельный кэш индексов на тест
+import datetime
+import random
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import log_index  # noqa: E402
+import loyalty_analyzer  # noqa: E402
+
+PHONES = ["7999%07d" % i for i in range(40)]
+ORDERS = ["A%05d" % i for i in range(60)]
+
+
+def full_log_lines(count: int, seed: int = 1, start=datetime.datetime(2024, 5, 1)):
+    """Записи full.log: (текст записи, correlationId или None); телефоны через 7 и 8, заказы в разном регистре"""
+    rnd = random.Random(seed)
+    moment = start
+    records = []
+    for number in range(count):
+        moment += datetime.timedelta(seconds=rnd.randint(1, 30))
+        phone = rnd.choice(PHONES)
+        written_phone = phone if rnd.random() < 0.7 else "8" + phone[1:]
+        order = rnd.choice(ORDERS)
+        written_order = order if rnd.random() < 0.7 else order.lower()
+        cid = str(uuid.UUID(int=rnd.getrandbits(128))) if rnd.random() < 0.9 else None
+        text = (f"{moment:%Y-%m-%d %H:%M:%S}.123 INFO [http-{number % 8}] Request phone={written_phone} "
+                f"Order {written_order}\n  body line {number}\n")
+        if cid:
+            text += f"  CorrelationId: {cid}\n"
+        records.append((text, cid))
+    return records
+
+
+def write_logs(directory: Path, count: int, seed: int = 1):
+    """full.log и loyaltyTrace.log из count запросов; последней идёт запись без ключей"""
+    directory.mkdir(parents=True, exist_ok=True)
+    rnd = random.Random(seed + 1000)
+    full, trace = [], []
+    for text, cid in full_log_lines(count, seed):
+        full.append(text)
+        if cid and rnd.random() < 0.8:
+            trace.append(f'LoyaltyTrace: {{"correlationId":"{cid}","ts":"{text[:19]}"}}\n')
+            if rnd.random() < 0.3:
+                trace.append(f"  details: accrual {len(trace)}\n")
+    # Последняя запись может дописываться, индексы её пропускают: пусть в ней не будет ключей
+    full.append("2030-01-01 00:00:00.000 INFO heartbeat\n")
+    trace.append('LoyaltyTrace: {"heartbeat":true}\n')
+    full_path, trace_path = directory / "full.log", directory / "loyaltyTrace.log"
+    full_path.write_text("startup banner without a timestamp\n" + "".join(full), encoding="utf-8")
+    trace_path.write_text("".join(trace), encoding="utf-8")
+    return full_path, trace_path
+
+
+@pytest.fixture(autouse=True)
+def index_cache(tmp_path, monkeypatch):
+    """Индексы каждого теста — в своём каталоге, без индексов и ответов, оставшихся от других тестов"""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(log_index, "_loaded", {})
+    monkeypatch.setattr(log_index, "_building", {})
+    monkeypatch.setattr(log_index, "_scheduled", set())
+    monkeypatch.setattr(loyalty_analyzer, "query_cache", loyalty_analyzer.QueryCache())
+    return tmp_path / "cache"
+
+
+@pytest.fixture
+def logs(tmp_path):
+    return write_logs(tmp_path / "logs", 3000)
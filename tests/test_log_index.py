@@ -0,0 +1,303 @@
+# test_log_index.py — двоичные таблицы индекса, дописывание и фильтры блоков
+import datetime
+import os
+import re
+import uuid
+from pathlib import Path
+
+import pytest
+
+import log_index
+from conftest import full_log_lines, write_logs
+from log_index import FullLogFilter, FullLogIndex, PostingTable, TraceFilter, TraceIndex, _map_index
+from log_search import TRACE_START, iter_records, normalize_order, parse_record, trace_entry_ids
+
+
+def cid(number: int) -> str:
+    return str(uuid.UUID(int=number * 7919 + 1))
+
+
+# Ключи трёх кодеков, включая текстовые разной длины и строки, не являющиеся UUID
+CODEC_KEYS = {
+    ("phone", "cid"): ["79990000001", "79990000002", "78001234567"],
+    ("text", "cid"): ["A1", "B0000000000LONG", "Ж-7", "A10"],
+    ("uuid", "ref"): [cid(1), cid(2), "not-a-uuid", cid(3)],
+}
+
+
+def posting(kind: str, number: int) -> tuple:
+    return (number * 100, cid(number) if number % 5 else "legacy-id") if kind == "cid" else (number * 100, number + 1)
+
+
+def saved(table: PostingTable, path) -> PostingTable:
+    """Таблица, записанная в файл и подключённая обратно через mmap"""
+    with open(path, "wb") as f:
+        f.write(b"\x00" * 3)
+        section = table.write(f)
+    loaded = PostingTable(table.key, table.kind)
+    loaded.attach(_map_index(path), section)
+    return loaded
+
+
+@pytest.mark.parametrize("key,kind", list(CODEC_KEYS))
+def test_posting_table_round_trip_and_merge(tmp_path, key, kind):
+    keys = CODEC_KEYS[(key, kind)]
+    expected = {}
+    table = PostingTable(key, kind)
+    for number in range(40):
+        item = posting(kind, number)
+        table.append(keys[number % 2], item)
+        expected.setdefault(keys[number % 2], []).append(item)
+
+    table = saved(table, tmp_path / "first.idx")
+    assert table.items() == expected
+
+    # Дописанное после загрузки сливается с сохранённым: новые ключи и продолжение старых
+    for number in range(40, 70):
+        item = posting(kind, number)
+        table.append(keys[number % len(keys)], item)
+        expected.setdefault(keys[number % len(keys)], []).append(item)
+    assert table.items() == expected
+    for name in keys:
+        assert table.get(name) == expected[name]
+
+    table = saved(table, tmp_path / "second.idx")
+    assert table.items() == expected
+    for name in keys:
+        assert table.get(name) == expected[name]
+    assert table.get("79990000099" if key == "phone" else "missing") == []
+
+
+def tables(index):
+    return {name: getattr(index, name).items() for name in index.fields}
+
+
+def append_requests(path, count: int, seed: int):
+    # Заглушка в конце остаётся последней записью: индексы её пропускают
+    data = path.read_bytes()
+    if b"2030-01-01" in data:
+        body, tail = data.rsplit(b"2030-01-01", 1)
+    else:
+        body, tail = data, b" 00:00:00.000 INFO heartbeat\n"
+    lines = "".join(text for text, _ in full_log_lines(count, seed, datetime.datetime(2024, 6, 1)))
+    path.write_bytes(body + lines.encode("utf-8") + b"2030-01-01" + tail)
+
+
+def test_update_after_append(logs):
+    full_path, _ = logs
+    opened = FullLogIndex.open(full_path)
+    size = opened.size
+    append_requests(full_path, 500, seed=7)
+    assert FullLogIndex.cached(full_path) is opened
+    updated = FullLogIndex.open(full_path)
+    assert updated is opened and updated.size > size
+    assert tables(updated) == tables(FullLogIndex.build(full_path))
+    # С диска поднимается то же, что в памяти
+    assert tables(FullLogIndex.load(full_path)) == tables(updated)
+
+
+def test_update_after_truncation(logs):
+    full_path, _ = logs
+    FullLogIndex.open(full_path)
+    with open(full_path, "r+b") as f:
+        f.truncate(os.path.getsize(full_path) // 2)
+    assert FullLogIndex.load(full_path) is None
+    assert tables(FullLogIndex.open(full_path)) == tables(FullLogIndex.build(full_path))
+
+
+def test_update_after_truncation_and_regrowth(logs):
+    full_path, _ = logs
+    size = FullLogIndex.open(full_path).size
+    # Обрезанный и снова дописанный дальше прежнего размера лог: конец проиндексированной части другой
+    with open(full_path, "r+b") as f:
+        f.truncate(size // 3)
+    append_requests(full_path, 3000, seed=5)
+    assert os.path.getsize(full_path) > size
+    assert FullLogIndex.load(full_path) is None
+    assert tables(FullLogIndex.open(full_path)) == tables(FullLogIndex.build(full_path))
+
+
+def test_update_after_rotation(logs):
+    full_path, trace_path = logs
+    FullLogIndex.open(full_path)
+    TraceIndex.open(trace_path)
+    rotated = full_path.with_name("full.log.1")
+    os.replace(full_path, rotated)
+    write_logs(full_path.parent, 800, seed=3)
+    # На прежнем пути теперь другой файл: индекс строится заново, у ротированного — свой
+    assert FullLogIndex.cached(full_path) is None
+    assert tables(FullLogIndex.open(full_path)) == tables(FullLogIndex.build(full_path))
+    assert tables(FullLogIndex.open(rotated)) == tables(FullLogIndex.build(rotated))
+    assert tables(TraceIndex.open(trace_path)) == tables(TraceIndex.build(trace_path))
+
+
+def covered(blocks, offset: int) -> bool:
+    return any(start <= offset and (end is None or offset < end) for start, end in blocks)
+
+
+def check_full_filter(path, block_filter):
+    with open(path, "rb") as f:
+        records = [parse_record(offset, data) for offset, data in iter_records(f)]
+    for record in records:
+        if record.offset >= block_filter.size:
+            continue
+        for phone in record.phones:
+            assert covered(block_filter.phone_blocks(phone), record.offset), phone
+        for order in record.orders:
+            assert covered(block_filter.order_blocks(order.lower()), record.offset), order
+        if record.correlation_id:
+            assert covered(block_filter.correlation_blocks(record.correlation_id.upper()), record.offset)
+
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    # Много блоков на маленьком логе
+    monkeypatch.setattr(log_index, "BLOCK_SIZE", 4096)
+
+
+def test_full_filter_has_no_false_negatives(logs, small_blocks):
+    full_path, _ = logs
+    block_filter = FullLogFilter.open(full_path)
+    assert len(block_filter.blocks) > 10
+    check_full_filter(full_path, block_filter)
+    # Дописанный лог: недобранный последний блок собирается заново
+    append_requests(full_path, 300, seed=9)
+    block_filter = FullLogFilter.open(full_path)
+    check_full_filter(full_path, block_filter)
+    check_full_filter(full_path, FullLogFilter.load(full_path))
+    # Ключа, которого нет в логе, фильтры почти везде отсекают
+    assert len(block_filter.order_blocks(normalize_order("Z99999"))) < len(block_filter.blocks) // 2
+
+
+def test_trace_filter_has_no_false_negatives(logs, small_blocks):
+    _, trace_path = logs
+    block_filter = TraceFilter.open(trace_path)
+    with open(trace_path, "rb") as f:
+        for offset, data in iter_records(f, TRACE_START):
+            if offset >= block_filter.size:
+                continue
+            for correlation_id in trace_entry_ids(data):
+                assert covered(block_filter.entry_blocks(correlation_id), offset), correlation_id
+
+
+def test_upper_case_correlation_ids_stay_binary(tmp_path):
+    full_path, _ = write_logs(tmp_path / "logs", 500)
+    full_path.write_bytes(re.sub(rb"(CorrelationId: )([0-9a-f-]+)", lambda m: m.group(1) + m.group(2).upper(),
+                                 full_path.read_bytes()))
+    index = FullLogIndex.open(full_path)
+    loaded = FullLogIndex.load(full_path)
+    # Все correlationId — UUID: в заголовке не остаётся ни одной строки
+    assert loaded.phones.value_codec.strings == loaded.orders.value_codec.strings == []
+    assert loaded.correlations.key_codec.strings == []
+    with open(full_path, "rb") as f:
+        records = [parse_record(offset, data) for offset, data in iter_records(f)]
+    record = next(r for r in reversed(records[:-1]) if r.correlation_id and r.phones)
+    assert record.correlation_id.isupper()
+    assert index.latest_phone(record.phones[0])[1] == record.correlation_id.lower()
+    assert loaded.latest_phone(record.phones[0])[1] == record.correlation_id.lower()
+    assert loaded.correlation_refs(record.correlation_id) == [(record.offset, record.length)]
+
+
+def test_save_retries_replace_and_leaves_no_temp_files(logs, index_cache, monkeypatch):
+    full_path, _ = logs
+    index = FullLogIndex.open(full_path)
+    target = FullLogIndex.index_path(full_path)
+    real_replace = os.replace
+
+    def locked(src, dst):
+        # Как на Windows: отображённый в память индекс не заменить
+        if Path(dst) == target:
+            raise PermissionError("mapped")
+        real_replace(src, dst)
+
+    monkeypatch.setattr(log_index.os, "replace", locked)
+    append_requests(full_path, 200, seed=11)
+    FullLogIndex.open(full_path)
+    temp_files = list(index_cache.glob("loyalty-analyzer/*.tmp"))
+    assert len(temp_files) == 1
+    # Таблицы уже читают новый файл, хоть он и не встал на место индекса
+    assert tables(index) == tables(FullLogIndex.build(full_path))
+
+    monkeypatch.setattr(log_index.os, "replace", real_replace)
+    append_requests(full_path, 200, seed=12)
+    FullLogIndex.open(full_path)
+    assert list(index_cache.glob("loyalty-analyzer/*.tmp")) == []
+    assert tables(FullLogIndex.load(full_path)) == tables(FullLogIndex.build(full_path))
+
+
+def test_prune_removes_stale_temp_files_and_counts_fresh_ones(index_cache):
+    root = index_cache / "loyalty-analyzer"
+    root.mkdir(parents=True)
+    store = log_index.IndexStore()
+    stale, fresh, old_index = root / "a.full.idx.1.tmp", root / "b.full.idx.2.tmp", root / "c.full.idx"
+    for path in (stale, fresh, old_index):
+        path.write_bytes(b"\x00" * 1000)
+    os.utime(stale, (0, 0))
+    os.utime(old_index, (1, 1))
+    store.set_limit(1500)
+    assert not stale.exists()
+    # Свежий временный файл не трогается, но занимает место: индекс вытеснен
+    assert fresh.exists() and not old_index.exists()
+
+
+def test_prune_evicts_least_recently_used_within_budget(tmp_path, monkeypatch):
+    root = tmp_path / "store"
+    root.mkdir()
+    store = log_index.IndexStore(root)
+    log = tmp_path / "full.log"
+    log.write_bytes(b"x")
+    clock = iter(range(100, 200))
+    monkeypatch.setattr(log_index.time, "time", lambda: next(clock))
+    names = ["a.full.idx", "b.full.idx", "c.full.idx", "d.full.idx"]
+    for name in names:
+        (root / name).write_bytes(b"\x00" * 1000)
+        store.touch(root / name, log)
+    store.touch(root / "a.full.idx", log)
+    # Индекс лога, которого больше нет, удаляется независимо от лимита
+    gone = tmp_path / "gone.log"
+    (root / "e.full.idx").write_bytes(b"\x00" * 10)
+    store.touch(root / "e.full.idx", gone)
+
+    store.set_limit(2500)
+    # Вытесняются давно не использованные: b и c; a только что использовался
+    assert sorted(path.name for path in root.glob("*.idx")) == ["a.full.idx", "d.full.idx"]
+    assert sorted(store._read()["entries"]) == ["a.full.idx", "d.full.idx"]
+
+    assert store.prune(keep=root / "d.full.idx") == 0
+    manifest = store._read()
+    manifest["limit"] = 0
+    store._write(manifest)
+    # keep (только что сохранённый индекс) не вытесняется даже при нулевом лимите
+    assert store.prune(keep=root / "d.full.idx") == 1
+    assert [path.name for path in root.glob("*.idx")] == ["d.full.idx"]
+
+
+def test_store_remembers_existing_last_logs(tmp_path):
+    store = log_index.IndexStore(tmp_path / "store")
+    full_path, trace_path = write_logs(tmp_path / "logs", 10)
+    store.remember_logs(full_path, trace_path)
+    assert log_index.IndexStore(tmp_path / "store").last_logs() == (str(full_path), str(trace_path))
+    os.remove(trace_path)
+    assert store.last_logs() == (str(full_path), None)
+
+
+def test_time_table_window_brackets_period(tmp_path):
+    table = log_index.TimeTable()
+    samples = [("2024-05-01 00:00:00", 0), ("2024-05-01 01:00:00", 1000), ("2024-05-01 02:00:00", 2000),
+               ("2024-05-01 02:00:00", 3000), ("2024-05-01 03:00:00", 4000)]
+    for stamp, offset in samples:
+        table.append(stamp, offset)
+    with open(tmp_path / "times.idx", "wb") as f:
+        section = table.write(f)
+    saved_table = table.reopened(_map_index(tmp_path / "times.idx"), section)
+    for times in (table, saved_table):
+        assert times.items() == samples
+        assert times.window() == (0, None)
+        # Записи между отметками могут попасть в период: начало — предыдущая отметка
+        assert times.window("2024-05-01 01:30:00") == (1000, None)
+        assert times.window("2024-05-01 02:00:00") == (1000, None)
+        assert times.window(until="2024-05-01 01:59:59") == (0, 2000)
+        # Конец периода включительно: записи с отметкой until остаются в окне
+        assert times.window(until="2024-05-01 02:00:00") == (0, 4000)
+        assert times.window("2023-01-01 00:00:00", "2030-01-01 00:00:00") == (0, None)
+        assert times.window("2030-01-01 00:00:00") == (4000, None)
@@ -0,0 +1,172 @@
+# test_log_search.py — разбиение логов на записи, согласие способов скана и слежение за логом
+import gzip
+import os
+
+import pytest
+
+import log_search
+from conftest import ORDERS, PHONES
+from log_index import FullLogIndex, TraceIndex
+from loyalty_analyzer import LogAnalyzer
+from log_search import (
+    FULL_LOG_NAME, RECORD_START, TRACE_START, LogFollower, expand_log_set, find_last_record, find_last_record_mmap,
+    find_last_record_parallel, find_last_trace_entry, find_last_trace_entry_mmap, iter_records, iter_records_reversed,
+    trace_entry_ids
+)
+
+
+def forward(path, pattern, chunk_size, start=0, end=None):
+    with open(path, "rb") as f:
+        f.seek(start)
+        return list(iter_records(f, pattern, chunk_size, end=end))
+
+
+def backward(path, pattern, chunk_size, start=0, end=None):
+    with open(path, "rb") as f:
+        return list(reversed(list(iter_records_reversed(f, pattern, chunk_size, start=start, end=end))))
+
+
+# Куски короче строки, короче заголовка и длиннее всего файла
+CHUNK_SIZES = [1, 7, 19, 64, 1000, log_search.CHUNK_SIZE]
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+def test_reverse_records_match_forward(logs, chunk_size):
+    full_path, trace_path = logs
+    for path, pattern in ((full_path, RECORD_START), (trace_path, TRACE_START)):
+        records = forward(path, pattern, chunk_size)
+        assert records == backward(path, pattern, chunk_size)
+        # Записи покрывают файл без пропусков, каждая кроме вводной начинается с заголовка
+        assert b"".join(data for _, data in records) == path.read_bytes()
+        assert all(pattern.match(data) for _, data in records[1:])
+
+
+@pytest.mark.parametrize("chunk_size", [7, 64, 1000])
+def test_records_split_across_chunk_boundary(tmp_path, chunk_size):
+    # Заголовок записи разрезан границей куска в каждой возможной точке
+    head = b"2024-05-01 10:00:00 first\n"
+    for shift in range(chunk_size):
+        path = tmp_path / f"full-{chunk_size}-{shift}.log"
+        second = b"2024-05-01 10:00:01 second CorrelationId: 1\n  body\n"
+        path.write_bytes(head + b"x" * shift + b"\n" + second + head)
+        records = forward(path, RECORD_START, chunk_size)
+        assert [data for _, data in records] == [head + b"x" * shift + b"\n", second, head]
+        assert records == backward(path, RECORD_START, chunk_size)
+
+
+def test_reverse_records_within_range(logs):
+    full_path, _ = logs
+    offsets = [offset for offset, _ in forward(full_path, RECORD_START, 1000)]
+    start, end = offsets[100], offsets[900]
+    assert forward(full_path, RECORD_START, 64, start, end) == backward(full_path, RECORD_START, 64, start, end)
+
+
+def scan_results(path, monkeypatch, phone=None, order_number=None):
+    # Диапазоны по 4 КБ: параллельный скан действительно делит файл
+    monkeypatch.setattr(log_search, "PARALLEL_MIN_RANGE", 4096)
+    results = {
+        "stream": find_last_record(path, phone, order_number),
+        "mmap": find_last_record_mmap(path, phone, order_number),
+        "parallel": find_last_record_parallel(path, phone, order_number, workers=2),
+    }
+    return {mode: record.correlation_id if record else None for mode, record in results.items()}
+
+
+def test_scan_modes_agree_with_index(logs, monkeypatch):
+    full_path, _ = logs
+    index = FullLogIndex.build(full_path)
+    queries = [(phone, None) for phone in PHONES + ["79998887766"]]
+    queries += [(None, order) for order in ORDERS + ["a00007", "Z99999"]]
+    for phone, order_number in queries:
+        entry = index.latest_phone(phone) if phone is not None else index.latest_order(order_number)
+        expected = entry[1] if entry else None
+        assert scan_results(full_path, monkeypatch, phone, order_number) == dict.fromkeys(
+            ("stream", "mmap", "parallel"), expected), (phone, order_number)
+
+
+def test_trace_scan_modes_agree_with_index(logs):
+    _, trace_path = logs
+    index = TraceIndex.build(trace_path)
+    with open(trace_path, "rb") as f:
+        ids = {cid for _, data in iter_records(f, TRACE_START) for cid in trace_entry_ids(data)}
+    for correlation_id in sorted(ids)[:50] + ["00000000-0000-0000-0000-000000000000"]:
+        ref = index.latest(correlation_id)
+        stream = find_last_trace_entry(trace_path, correlation_id)
+        mapped = find_last_trace_entry_mmap(trace_path, correlation_id.upper())
+        assert (stream[0] if stream else None) == (ref[0] if ref else None)
+        assert (mapped[0] if mapped else None) == (ref[0] if ref else None)
+
+
+def header(number: int) -> bytes:
+    return f"2024-05-01 10:00:{number:02d} request {number}\n".encode("ascii")
+
+
+def test_follower_returns_only_appended_records(tmp_path):
+    path = tmp_path / "full.log"
+    path.write_bytes(header(0) + header(1))
+    follower = LogFollower(path)
+    assert follower.poll() == []
+    with open(path, "ab") as f:
+        f.write(header(2) + b"  body\n" + header(3))
+    # Последняя запись придерживается до следующего заголовка, а по простою отдаётся один раз
+    assert [data for _, data in follower.poll()] == [header(2) + b"  body\n"]
+    assert [data for _, data in follower.poll()] == [header(3)]
+    assert follower.poll() == []
+
+
+def test_follower_restarts_after_rotation_and_truncation(tmp_path, capsys):
+    path = tmp_path / "full.log"
+    path.write_bytes(header(0) * 20)
+    follower = LogFollower(path)
+    os.replace(path, tmp_path / "full.log.1")
+    assert follower.poll() == []
+    path.write_bytes(header(5) + header(6))
+    assert [data for _, data in follower.poll()] == [header(5)]
+    assert [data for _, data in follower.poll()] == [header(6)]
+
+    with open(path, "r+b") as f:
+        f.truncate(0)
+        f.write(header(7))
+    follower.poll()
+    assert [data for _, data in follower.poll()] == [header(7)]
+    # Уведомление о ротации — отладочное: в stdout (и в --json) оно не попадает
+    out, err = capsys.readouterr()
+    assert out == "" and "ротации" in err
+
+
+def rotated_set(directory):
+    """full.log, full.log.1 и full.log.2.gz с убывающим временем изменения"""
+    directory.mkdir()
+    files = {
+        "full.log": header(30) + b"  Request phone=79990000001 CorrelationId: 33333333-0000-0000-0000-000000000000\n",
+        "full.log.1": header(20) + b"  Request phone=79990000001 CorrelationId: 22222222-0000-0000-0000-000000000000\n",
+        "full.log.2.gz": gzip.compress(
+            header(10) + b"  Request phone=79990000002 CorrelationId: 11111111-0000-0000-0000-000000000000\n"
+            + header(11) + b"  tail\n"),
+    }
+    for age, (name, data) in enumerate(files.items()):
+        (directory / name).write_bytes(data)
+        os.utime(directory / name, (1_700_000_000 - age * 3600,) * 2)
+    # Чужие файлы в папке в набор не входят
+    (directory / "full.log.bak").write_bytes(b"")
+    (directory / "loyaltyTrace.log").write_bytes(b"")
+    return [directory / name for name in files]
+
+
+def test_expand_log_set_orders_rotated_gzip_members(tmp_path):
+    members = rotated_set(tmp_path / "logs")
+    assert expand_log_set(tmp_path / "logs", FULL_LOG_NAME) == members
+    assert sorted(expand_log_set(str(tmp_path / "logs" / "full.log*.gz"), FULL_LOG_NAME)) == [members[2]]
+    assert expand_log_set(members[1], FULL_LOG_NAME) == [members[1]]
+    with pytest.raises(FileNotFoundError):
+        expand_log_set(tmp_path / "logs", "other.log")
+
+
+def test_rotated_set_is_searched_newest_first(tmp_path):
+    members = rotated_set(tmp_path / "logs")
+    analyzer = LogAnalyzer(tmp_path / "logs", tmp_path / "logs")
+    assert analyzer.find_correlation_id(phone="79990000001") == "33333333-0000-0000-0000-000000000000"
+    # Ключ есть только в сжатом архиве: до него доходит поиск, и индекс архива даёт тот же ответ
+    assert analyzer.find_correlation_id(phone="79990000002") == "11111111-0000-0000-0000-000000000000"
+    index = FullLogIndex.build(members[2])
+    assert index.compressed and index.latest_phone("79990000002")[1] == "11111111-0000-0000-0000-000000000000"
@@ -0,0 +1,243 @@
+# test_loyalty_analyzer.py — поиск по паре логов: индексы, сканы, периоды и CLI
+import json
+import os
+import re
+from pathlib import Path
+
+import log_index
+import loyalty_analyzer
+from conftest import PHONES, write_logs
+from log_index import FullLogIndex, TraceIndex
+from log_search import (
+    iter_records, iter_trace_entries, matching_records, parse_record, read_entry, record_timestamp, trace_entry_ids
+)
+from loyalty_analyzer import LogAnalyzer, QueryCache, main
+
+
+def test_bulk_lookup_scans_while_index_is_being_updated(logs, monkeypatch):
+    full_path, trace_path = logs
+    keys = PHONES[:10] + ["79998887766"]
+    expected = LogAnalyzer(full_path, trace_path).bulk_lookup(keys)
+    FullLogIndex.open(full_path)
+    TraceIndex.open(trace_path)
+    assert LogAnalyzer(full_path, trace_path).bulk_lookup(keys) == expected
+
+    # Фоновое построение дописывает индекс: его таблицы не читаются, файл сканируется
+    FullLogIndex.schedule(full_path)
+    TraceIndex.schedule(trace_path)
+
+    def busy(*args):
+        raise AssertionError("индекс читается во время дописывания")
+
+    monkeypatch.setattr(FullLogIndex, "latest_phone", busy)
+    monkeypatch.setattr(TraceIndex, "latest", busy)
+    analyzer = LogAnalyzer(full_path, trace_path)
+    assert analyzer.bulk_lookup(keys) == expected
+    assert not analyzer.used_scan
+
+
+def run_cli(capsys, *argv):
+    code = main(list(argv))
+    out, err = capsys.readouterr()
+    return code, out, err
+
+
+def test_search_full_trace_has_no_marker(logs, capsys):
+    full_path, trace_path = logs
+    analyzer = LogAnalyzer(full_path, trace_path)
+    phone, found = next((phone, found) for phone in PHONES
+                        for found in [analyzer.search(phone=phone)] if found.trace)
+    code, out, _ = run_cli(capsys, "search", "--phone", phone, "--full", str(full_path), "--trace", str(trace_path),
+                           "--full-trace")
+    assert code == 0
+    assert out.split("\n", 1)[1].rstrip("\n") == f"LoyaltyTrace: {found.trace.body()[len('LoyaltyTrace:'):].strip()}"
+    code, out, _ = run_cli(capsys, "search", "--phone", phone, "--full", str(full_path), "--trace", str(trace_path),
+                           "--full-trace", "--json")
+    output = json.loads(out)
+    assert output["loyalty_trace"] == found.trace.summary
+    assert output["loyalty_trace_body"].startswith(found.trace.summary)
+    assert "LoyaltyTrace:" not in output["loyalty_trace_body"]
+
+
+def test_index_progress_ends_at_total(logs, capsys):
+    full_path, trace_path = logs
+    code, _, err = run_cli(capsys, "index", "--full", str(full_path), "--trace", str(trace_path), "--progress")
+    assert code == 0
+    last = err.strip().split("\r")[-1]
+    done, total = re.match(r"Прочитано (\S+) из (\S+) МБ", last).groups()
+    assert done == total
+
+
+def log_args(full_path, trace_path):
+    return ["--full", str(full_path), "--trace", str(trace_path)]
+
+
+def test_search_exit_codes_and_json(logs, capsys, tmp_path):
+    full_path, trace_path = logs
+    phone = PHONES[0]
+    result = LogAnalyzer(full_path, trace_path).search(phone=phone)
+    code, out, _ = run_cli(capsys, "search", "--phone", "8" + phone[1:], *log_args(full_path, trace_path), "--json")
+    assert code == 0
+    assert json.loads(out) == {"phone": phone, "order": None, "correlation_id": result.correlation_id,
+                               "loyalty_trace": result.trace.summary if result.trace else None}
+
+    code, out, _ = run_cli(capsys, "search", "--order", "Z99999", *log_args(full_path, trace_path))
+    assert code == 1
+    assert out.startswith("CorrelationId: не найден")
+
+    # Некорректный номер и пустой набор логов — ошибка с кодом 2, а не «не найдено»
+    code, out, err = run_cli(capsys, "search", "--phone", "123", *log_args(full_path, trace_path))
+    assert (code, out) == (2, "") and err.startswith("Ошибка:")
+    empty = tmp_path / "empty"
+    empty.mkdir()
+    code, out, err = run_cli(capsys, "search", "--phone", phone, *log_args(empty, trace_path))
+    assert (code, out) == (2, "") and "full.log" in err
+
+
+def test_bulk_json_matches_lookup(logs, capsys, tmp_path):
+    full_path, trace_path = logs
+    keys = PHONES[:5] + ["79998887766"]
+    key_list = tmp_path / "keys.txt"
+    key_list.write_text("\n".join(keys + ["not a phone"]), encoding="utf-8")
+    expected = LogAnalyzer(full_path, trace_path).bulk_lookup(keys)
+    code, out, err = run_cli(capsys, "bulk", "--list", str(key_list), *log_args(full_path, trace_path), "--json")
+    assert code == 0
+    assert json.loads(out) == [{"key": key, "correlation_id": cid, "loyalty_trace": trace} for key, cid, trace in expected]
+    assert "Пропущено некорректных строк: 1" in err
+
+
+def test_query_cache_is_invalidated_when_a_log_changes(logs, monkeypatch):
+    full_path, trace_path = logs
+    calls = []
+    compute = LogAnalyzer._find_correlation_id
+
+    def counted(self, *args):
+        calls.append(args)
+        return compute(self, *args)
+
+    monkeypatch.setattr(LogAnalyzer, "_find_correlation_id", counted)
+    phone = PHONES[1]
+    first = LogAnalyzer(full_path, trace_path).find_correlation_id(phone=phone)
+    # Новый анализатор на тех же файлах берёт ответ из общего кэша
+    assert LogAnalyzer(full_path, trace_path).find_correlation_id(phone=phone) == first
+    assert len(calls) == 1
+
+    with open(full_path, "ab") as f:
+        f.write(f"2031-01-01 00:00:00 Request phone={phone}\n"
+                "  CorrelationId: 99999999-0000-0000-0000-000000000000\n".encode("ascii"))
+    assert LogAnalyzer(full_path, trace_path).find_correlation_id(phone=phone) == \
+        "99999999-0000-0000-0000-000000000000"
+    assert len(calls) == 2
+
+
+def test_query_cache_evicts_least_recently_used():
+    cache = QueryCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", None)
+    assert cache.get("a") == (True, 1)
+    cache.put("c", 3)
+    # «Не найдено» тоже ответ, но b использовался давнее всех
+    assert cache.get("b") == (False, None)
+    assert cache.get("a") == (True, 1) and cache.get("c") == (True, 3)
+
+
+def rotated_logs(tmp_path):
+    """Папка с двумя поколениями обоих логов: .1 — старшее"""
+    old_full, old_trace = write_logs(tmp_path / "old", 400, seed=2)
+    log_dir = tmp_path / "set"
+    log_dir.mkdir()
+    for path in (old_full, old_trace):
+        rotated = log_dir / (path.name + ".1")
+        os.replace(path, rotated)
+        os.utime(rotated, (1_700_000_000, 1_700_000_000))
+    write_logs(log_dir, 400, seed=3)
+    return log_dir
+
+
+def expected_history(log_dir, phone):
+    """(отметка, correlationId, смещения записей трассировки) прямым разбором файлов, от новых к старым"""
+    history, traces = [], {}
+    for name in ("loyaltyTrace.log", "loyaltyTrace.log.1"):
+        with open(log_dir / name, "rb") as f:
+            for offset, data in reversed(list(iter_trace_entries(f))):
+                for cid in trace_entry_ids(data):
+                    traces.setdefault(cid, []).append((name, offset))
+    for name in ("full.log", "full.log.1"):
+        with open(log_dir / name, "rb") as f:
+            for record in reversed(list(matching_records(iter_records(f), phone=phone))):
+                history.append((record_timestamp(read_entry(log_dir / name, record.offset, record.length)),
+                                record.correlation_id, traces.get(record.correlation_id.lower(), [])))
+    return history
+
+
+def test_timeline_pages_cover_history_newest_first(tmp_path):
+    log_dir = rotated_logs(tmp_path)
+    phone = PHONES[4]
+    expected = expected_history(log_dir, phone)
+    timeline = LogAnalyzer(log_dir, log_dir).timeline(phone=phone)
+    assert len(timeline) == len(expected) > 10
+    # Страницы по 7 записей переходят из нового файла в ротированный без пропусков и повторов
+    entries = [entry for start in range(0, len(timeline), 7) for entry in timeline.page(start, 7)]
+    assert [(entry.timestamp, entry.correlation_id,
+             [(Path(trace.path).name, trace.offset) for trace in entry.traces]) for entry in entries] == expected
+    assert timeline.page(len(timeline), 7) == []
+    assert timeline.page(len(timeline) - 2, 7) == entries[-2:]
+
+
+def test_find_by_correlation_id_collects_both_logs(tmp_path, capsys):
+    log_dir = rotated_logs(tmp_path)
+    with open(log_dir / "full.log", "rb") as f:
+        record = next(record for _, data in iter_records(f) for record in [parse_record(0, data)]
+                      if record.correlation_id and record.phones)
+    wanted = record.correlation_id
+    # Та же заявка дописана после построения индекса: её находит скан хвоста
+    FullLogIndex.open(log_dir / "full.log")
+    with open(log_dir / "full.log", "ab") as f:
+        f.write(f"2031-01-01 00:00:00 Retry phone=79990000999 Order R-1\n  CorrelationId: {wanted}\n".encode("ascii"))
+
+    lookup = LogAnalyzer(log_dir, log_dir).find_by_correlation_id(f"  {wanted.upper()} ")
+    assert lookup.correlation_id == wanted
+    assert [item.timestamp for item in lookup.records][0] == "2031-01-01 00:00:00"
+    assert len(lookup.records) == 2
+    assert lookup.phones == ("79990000999",) + record.phones
+    assert lookup.orders == ("R-1",) + record.orders
+    with open(log_dir / "loyaltyTrace.log", "rb") as f:
+        trace_offsets = [offset for offset, data in iter_trace_entries(f) if wanted in trace_entry_ids(data)]
+    assert [trace.offset for trace in lookup.traces] == list(reversed(trace_offsets))
+
+    code, _, _ = run_cli(capsys, "correlation", "--id", "00000000-0000-0000-0000-000000000000",
+                         *log_args(log_dir, log_dir))
+    assert code == 1
+
+
+SINCE, UNTIL = "2024-05-01 03:00:00", "2024-05-01 06:59:59"
+
+
+def in_period_history(full_path, phone):
+    with open(full_path, "rb") as f:
+        return [record.correlation_id for record in matching_records(iter_records(f), phone=phone)
+                if SINCE <= record_timestamp(read_entry(full_path, record.offset, record.length)) <= UNTIL]
+
+
+def test_period_search_agrees_with_and_without_index(logs, monkeypatch):
+    full_path, trace_path = logs
+    # Частые отметки времени: окно периода действительно сужает индекс
+    monkeypatch.setattr(log_index, "TIME_SAMPLE_STEP", 16)
+    expected = {phone: in_period_history(full_path, phone) for phone in PHONES}
+    assert any(expected.values())
+
+    scanned = {phone: LogAnalyzer(full_path, trace_path, since=SINCE, until=UNTIL).find_correlation_id(phone=phone)
+               for phone in PHONES}
+    index = FullLogIndex.open(full_path)
+    assert len(index.times) > 100
+    start, end = index.window(SINCE, UNTIL)
+    assert 0 < start and end is not None and end < index.size
+    loyalty_analyzer.query_cache.clear()
+    indexed = {phone: LogAnalyzer(full_path, trace_path, since=SINCE, until=UNTIL).find_correlation_id(phone=phone)
+               for phone in PHONES}
+    latest = {phone: history[-1] if history else None for phone, history in expected.items()}
+    assert scanned == latest == indexed
+
+    phone = max(PHONES, key=lambda phone: len(expected[phone]))
+    timeline = LogAnalyzer(full_path, trace_path, since=SINCE, until=UNTIL).timeline(phone=phone)
+    assert [entry.correlation_id for entry in timeline.page(0, len(timeline))] == list(reversed(expected[phone]))
@@ -10,6 +10,14 @@ from PyQt6.QtCore import QThread, pyqtSignal, QCoreApplication
 import urllib.request
 import urllib.error
 
+# Модули приложения, которые скачиваются и устанавливаются при обновлении
+APP_MODULES = [
+    "main.py", "log_search.py", "log_index.py", "loyalty_analyzer.py", "search_worker.py",
+    "result_models.py",
+]
+# Без этих файлов обновление не ставится
+REQUIRED_FILES = ["main.py", "version.txt"]
+
 
 class Version:
     def __init__(self, version_str: str):
@@ -89,9 +97,9 @@ class HTTPUpdater:
             temp_dir = app_dir / f"temp_update_v{version}_{int(time.time())}"
             temp_dir.mkdir(exist_ok=True)
 
-            # Скачиваем файлы
-            required_files = ["main.py", "version.txt"]
-            for filename in required_files:
+            # Скачиваем файлы: без main.py и version.txt обновления нет, остальные модули
+            # могут отсутствовать на сервере — тогда их докачает main.py при запуске
+            for filename in APP_MODULES + ["version.txt"]:
                 file_url = version_url + filename
                 local_path = temp_dir / filename
 
@@ -102,6 +110,9 @@ class HTTPUpdater:
                             out_file.write(content)
                     print(f"[DEBUG] Скачано: {filename} → {local_path}")
                 except urllib.error.HTTPError as e:
+                    if filename not in REQUIRED_FILES:
+                        print(f"[DEBUG] Нет на сервере, пропущен: {filename} (ошибка {e.code})")
+                        continue
                     shutil.rmtree(temp_dir, ignore_errors=True)
                     return False, f"Файл {filename} не найден на сервере (ошибка {e.code})"
 
@@ -110,14 +121,14 @@ class HTTPUpdater:
             backup_dir = app_dir / f"backup_v{version}_{timestamp}"
             backup_dir.mkdir(exist_ok=True)
 
-            for fname in ["main.py", "updater.py", "version.txt"]:
+            for fname in APP_MODULES + ["updater.py", "version.txt"]:
                 fpath = app_dir / fname
                 if fpath.exists():
                     shutil.copy2(fpath, backup_dir / fname)
                     print(f"[DEBUG] Бэкап: {fname}")
 
             # КОПИРУЕМ ФАЙЛЫ ТОЛЬКО В ДИРЕКТОРИЮ ПРИЛОЖЕНИЯ
-            for fname in ["main.py", "version.txt"]:
+            for fname in APP_MODULES + ["version.txt"]:
                 src = temp_dir / fname
                 dst = app_dir / fname
                 if src.exists():